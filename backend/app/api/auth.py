@@ -1,15 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlmodel import Session, select, SQLModel
+from sqlmodel import select, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import and_, func, or_, true
 from typing import Optional
-from app.core.database import get_session
+from app.core.database import get_async_session, release_async_connection
 from app.models.user import User
 from app.schemas.auth import UserCreate, UserRead, Token
-from app.core.security import get_password_hash, verify_password, create_access_token
-from app.api.deps import get_current_user
+from app.core.security import get_password_hash_async, verify_and_update_password_async, create_access_token
+from app.api.deps import get_async_read_session, get_current_user
 from datetime import timedelta, datetime
 from app.core.config import settings
-from app.core.email import send_otp_email
+from app.core.email import mail_queue, queue_otp_email, smtp_configured
+from app.core.kpi import kpi_cache
+from app.core.auth_cache import auth_cache
 from app.models.otp import OTP
 import logging
 import random
@@ -20,31 +24,41 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 @router.post("/signup", response_model=UserRead)
-def create_user(user: UserCreate, session: Session = Depends(get_session)):
+async def create_user(user: UserCreate, session: AsyncSession = Depends(get_async_session)):
     logger.info(f"🔵 SIGNUP REQUEST - Email: {user.email}")
-    existing_user = session.exec(select(User).where(User.email == user.email)).first()
+    existing_user = (await session.exec(select(User).where(User.email == user.email))).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_password = get_password_hash(user.password)
+    await release_async_connection(session)
+    hashed_password = await get_password_hash_async(user.password)
     new_user = User(email=user.email, password_hash=hashed_password, full_name=user.full_name, role=user.role)
     session.add(new_user)
-    session.commit()
-    session.refresh(new_user)
+    await session.commit()
+    await session.refresh(new_user)
     return new_user
 
 @router.post("/token", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_async_session)):
     logger.info(f"🔵 LOGIN REQUEST - Username: {form_data.username}")
-    user = session.exec(select(User).where(User.email == form_data.username)).first()
-    if not user or not verify_password(form_data.password, user.password_hash):
+    user = (await session.exec(select(User).where(User.email == form_data.username))).first()
+    verified, new_hash = False, None
+    if user:
+        await release_async_connection(session, user)
+        verified, new_hash = await verify_and_update_password_async(form_data.password, user.password_hash)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # Stored hash used outdated Argon2 parameters
+        user.password_hash = new_hash
+        session.add(user)
+        await session.commit()
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email, "uid": user.id}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -57,114 +71,123 @@ class UserUpdate(SQLModel):
     password: str | None = None
 
 @router.put("/me", response_model=UserRead)
-def update_user_me(user_update: UserUpdate, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    if user_update.full_name:
-        current_user.full_name = user_update.full_name
+async def update_user_me(user_update: UserUpdate, session: AsyncSession = Depends(get_async_session), current_user: User = Depends(get_current_user)):
+    password_hash = None
     if user_update.password:
-        current_user.password_hash = get_password_hash(user_update.password)
+        await release_async_connection(session)
+        password_hash = await get_password_hash_async(user_update.password)
+    # current_user is a cached snapshot; change the stored row
+    user = await session.get(User, current_user.id)
+    if user_update.full_name:
+        user.full_name = user_update.full_name
+    if password_hash:
+        user.password_hash = password_hash
     
-    session.add(current_user)
-    session.commit()
-    session.refresh(current_user)
-    return current_user
+    session.add(user)
+    await session.commit()
+    await session.refresh(user)
+    auth_cache.invalidate_user(user.id)
+    return user
 
 @router.get("/stats")
-def get_stats(
+async def get_stats(
     move_type: Optional[str] = None,
     status: Optional[str] = None,
     warehouse_id: Optional[int] = None,
     category: Optional[str] = None,
-    session: Session = Depends(get_session), 
+    session: AsyncSession = Depends(get_async_read_session),
+    primary_session: AsyncSession = Depends(get_async_session),
     current_user: User = Depends(get_current_user)
 ):
-    """Get dashboard stats with optional filters"""
+    """
+    Get dashboard stats with optional filters
+
+    Unfiltered and status-only requests are answered from the per-worker KPI
+    snapshot; warehouse and category filters run one aggregate query on the
+    read replica. The snapshot is rebuilt from the primary: the write hooks
+    adjust it in place afterwards, so counts missing from a lagging replica
+    would stay missing until it expires.
+    """
     logger.info(f"🔵 STATS REQUEST - User: {current_user.email}")
-    from app.models.product import Product
-    from app.models.inventory import StockMove, Warehouse
-    
-    # Get products with optional category filter
+    if not warehouse_id and not category:
+        snapshot = await kpi_cache.get_async(primary_session)
+        moves = snapshot["moves"]
+        selected_status = status or "draft"
+        return {
+            "total_products": snapshot["total_products"],
+            "low_stock": snapshot["low_stock"],
+            "incoming": moves.get(("IN", selected_status), 0),
+            "outgoing": moves.get(("OUT", selected_status), 0),
+            "internal_transfers": sum(c for (t, _), c in moves.items() if t == "INT"),
+            "adjustments": sum(c for (t, _), c in moves.items() if t == "ADJ")
+        }
+
+    from app.models.product import Product, low_stock_predicate
+    from app.models.inventory import StockMove
     from app.models.category import Category
-    product_query = select(Product)
+    
+    # Products with optional category filter: match by category name first,
+    # falling back to the old category field when no such category exists
+    product_filter = true()
     if category:
-        # Try to find category by name first (for backward compatibility)
-        cat = session.exec(select(Category).where(Category.name == category)).first()
-        if cat:
-            product_query = product_query.where(Product.category_id == cat.id)
-        else:
-            # Fallback to old category field
-            product_query = product_query.where(Product.category == category)
-    total_products = session.exec(product_query).all()
-    # Count products below minimum stock level (or < 10 if no min_stock_level set)
-    low_stock = len([
-        p for p in total_products 
-        if (p.min_stock_level is not None and p.current_stock < p.min_stock_level) or 
-           (p.min_stock_level is None and p.current_stock < 10)
-    ])
-    
-    # Count moves with filters
-    incoming_query = select(StockMove).where(StockMove.move_type == 'IN')
-    outgoing_query = select(StockMove).where(StockMove.move_type == 'OUT')
-    
-    if status:
-        incoming_query = incoming_query.where(StockMove.status == status)
-        outgoing_query = outgoing_query.where(StockMove.status == status)
-    else:
-        # Default: count draft moves
-        incoming_query = incoming_query.where(StockMove.status == 'draft')
-        outgoing_query = outgoing_query.where(StockMove.status == 'draft')
+        category_id = select(Category.id).where(Category.name == category).scalar_subquery()
+        product_filter = or_(
+            Product.category_id == category_id,
+            and_(category_id.is_(None), Product.category == category)
+        )
+    product_counts = select(
+        func.count().label("total_products"),
+        # Below minimum stock level (or < 10 if no min_stock_level set)
+        func.count().filter(low_stock_predicate()).label("low_stock")
+    ).where(product_filter).subquery()
     
+    # Incoming/outgoing honour status (default: draft) and warehouse filters;
+    # internal transfers and adjustments are counted over all moves
+    move_filter = StockMove.status == (status or "draft")
     if warehouse_id:
-        incoming_query = incoming_query.where(
-            (StockMove.dest_warehouse_id == warehouse_id) | 
-            (StockMove.source_warehouse_id == warehouse_id)
-        )
-        outgoing_query = outgoing_query.where(
+        move_filter = move_filter & (
             (StockMove.source_warehouse_id == warehouse_id) |
             (StockMove.dest_warehouse_id == warehouse_id)
         )
+    move_counts = select(
+        func.count().filter((StockMove.move_type == "IN") & move_filter).label("incoming"),
+        func.count().filter((StockMove.move_type == "OUT") & move_filter).label("outgoing"),
+        func.count().filter(StockMove.move_type == "INT").label("internal_transfers"),
+        func.count().filter(StockMove.move_type == "ADJ").label("adjustments")
+    ).subquery()
     
-    incoming = session.exec(incoming_query).all()
-    outgoing = session.exec(outgoing_query).all()
-    
-    # Get additional stats
-    internal_transfers = session.exec(
-        select(StockMove).where(StockMove.move_type == 'INT')
-    ).all()
-    adjustments = session.exec(
-        select(StockMove).where(StockMove.move_type == 'ADJ')
-    ).all()
-    
-    return {
-        "total_products": len(total_products),
-        "low_stock": low_stock,
-        "incoming": len(incoming),
-        "outgoing": len(outgoing),
-        "internal_transfers": len(internal_transfers),
-        "adjustments": len(adjustments)
-    }
+    # Both subqueries return exactly one row
+    stats = (await session.exec(
+        select(product_counts, move_counts)
+        .select_from(product_counts.join(move_counts, true()))
+    )).one()
+    return dict(stats._mapping)
 
 @router.post("/forgot-password")
-def request_password_reset(email: str = Query(..., description="User email address"), session: Session = Depends(get_session)):
+async def request_password_reset(email: str = Query(..., description="User email address"), session: AsyncSession = Depends(get_async_session)):
     """Request password reset OTP"""
     logger.info(f"🔵 PASSWORD RESET REQUEST - Email: {email}")
     
     # Check if user exists
-    user = session.exec(select(User).where(User.email == email)).first()
+    user = (await session.exec(select(User).where(User.email == email))).first()
     if not user:
         # Don't reveal if user exists or not (security best practice)
         return {"message": "If the email exists, an OTP has been sent"}
+    if not smtp_configured():
+        logger.error("SMTP credentials not configured")
+        raise HTTPException(status_code=500, detail="Failed to send OTP email. Please check SMTP configuration.")
     
     # Generate 6-digit OTP
     otp_code = ''.join(random.choices(string.digits, k=6))
     
     # Invalidate any existing unused OTPs for this email
-    existing_otps = session.exec(
+    existing_otps = (await session.exec(
         select(OTP).where(
             (OTP.email == email) & 
             (OTP.used == False) &
             (OTP.expires_at > datetime.utcnow())
         )
-    ).all()
+    )).all()
     for otp in existing_otps:
         otp.used = True
         session.add(otp)
@@ -177,31 +200,30 @@ def request_password_reset(email: str = Query(..., description="User email addre
         used=False
     )
     session.add(new_otp)
-    session.commit()
     
-    # Send email
-    if send_otp_email(email, otp_code):
-        return {"message": "If the email exists, an OTP has been sent"}
-    else:
-        raise HTTPException(status_code=500, detail="Failed to send OTP email. Please check SMTP configuration.")
+    # The email is committed with the OTP and sent in the background
+    queue_otp_email(session, email, otp_code)
+    await session.commit()
+    mail_queue.wake()
+    return {"message": "If the email exists, an OTP has been sent"}
 
 @router.post("/verify-otp")
-def verify_otp(
+async def verify_otp(
     email: str = Query(..., description="User email address"),
     otp_code: str = Query(..., description="6-digit OTP code"),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Verify OTP code (doesn't mark as used - that happens in reset-password)"""
     logger.info(f"🔵 OTP VERIFICATION - Email: {email}")
     
-    otp = session.exec(
+    otp = (await session.exec(
         select(OTP).where(
             (OTP.email == email) &
             (OTP.otp_code == otp_code) &
             (OTP.used == False) &
             (OTP.expires_at > datetime.utcnow())
         )
-    ).first()
+    )).first()
     
     if not otp:
         raise HTTPException(status_code=400, detail="Invalid or expired OTP")
@@ -212,41 +234,43 @@ def verify_otp(
     return {"message": "OTP verified successfully", "verified": True}
 
 @router.post("/reset-password")
-def reset_password(
+async def reset_password(
     email: str = Query(..., description="User email address"),
     otp_code: str = Query(..., description="6-digit OTP code"),
     new_password: str = Query(..., description="New password (min 8 characters)"),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Reset password after OTP verification"""
     logger.info(f"🔵 PASSWORD RESET - Email: {email}")
     
     # Verify OTP first
-    otp = session.exec(
+    otp = (await session.exec(
         select(OTP).where(
             (OTP.email == email) &
             (OTP.otp_code == otp_code) &
             (OTP.used == False) &
             (OTP.expires_at > datetime.utcnow())
         )
-    ).first()
+    )).first()
     
     if not otp:
         raise HTTPException(status_code=400, detail="Invalid or expired OTP")
     
     # Get user
-    user = session.exec(select(User).where(User.email == email)).first()
+    user = (await session.exec(select(User).where(User.email == email))).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     # Update password
-    user.password_hash = get_password_hash(new_password)
+    await release_async_connection(session, user, otp)
+    user.password_hash = await get_password_hash_async(new_password)
     session.add(user)
     
     # Mark OTP as used
     otp.used = True
     session.add(otp)
     
-    session.commit()
+    await session.commit()
+    auth_cache.invalidate_user(user.id)
     
     return {"message": "Password reset successfully"}
@@ -2,28 +2,80 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.core.auth_cache import auth_cache
 from app.core.config import settings
-from app.core.database import get_session
+from app.core.database import get_async_replica_session, get_async_session, get_replica_session, get_session
+from app.core.replica import note_user, use_replica
 from app.models.user import User
-from app.schemas.auth import TokenData
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
+async def get_current_user(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_async_session)):
+    """
+    Resolve the bearer token to its user.
+
+    Decoded claims and the user snapshot come from auth_cache when present, so
+    a repeated token costs neither a signature check nor a query. The returned
+    User is a detached copy without password_hash; load the row through the
+    session to modify it.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        email: str = payload.get("sub")
+    claims = auth_cache.get_claims(token)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        except JWTError:
+            raise credentials_exception
+        email = claims.get("sub")
         if email is None:
             raise credentials_exception
-        token_data = TokenData(email=email)
-    except JWTError:
-        raise credentials_exception
-    user = session.exec(select(User).where(User.email == token_data.email)).first()
-    if user is None:
-        raise credentials_exception
-    return user
+        if claims.get("uid") is None:
+            # Token issued before the user id was added to the claims
+            user_id = (await session.exec(select(User.id).where(User.email == email))).first()
+            if user_id is None:
+                raise credentials_exception
+            claims = {**claims, "uid": user_id}
+        auth_cache.store_claims(token, claims)
+
+    snapshot = auth_cache.get_user(claims["uid"])
+    if snapshot is None:
+        user = await session.get(User, claims["uid"])
+        if user is None:
+            raise credentials_exception
+        snapshot = auth_cache.store_user(user)
+    if session.in_transaction():
+        # The endpoint gets this same session; don't keep a connection checked out for it meanwhile
+        await session.rollback()
+    note_user(snapshot["id"])
+    return User(**snapshot)
+
+def get_current_admin(current_user: User = Depends(get_current_user)) -> User:
+    if current_user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
+async def get_read_session(
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
+    replica: Session = Depends(get_replica_session)
+) -> Session:
+    """
+    Session for read-only endpoints that can tolerate replica lag: the read
+    replica, or the primary when none is configured or the user wrote
+    recently (see app/core/replica.py). Only the returned session opens a
+    connection.
+    """
+    return replica if use_replica(current_user.id) else session
+
+async def get_async_read_session(
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_async_session),
+    replica: AsyncSession = Depends(get_async_replica_session)
+) -> AsyncSession:
+    """get_read_session() for async endpoints"""
+    return replica if use_replica(current_user.id) else session
@@ -1,12 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select
-from typing import List, Optional
-from app.core.database import get_session
-from app.models.inventory import StockMove, ProductStock
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import insert, tuple_
+from sqlmodel import Session, select, col
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import List, Optional, Set
+from datetime import datetime
+from collections import Counter
+from app.core.database import get_session, get_async_session
+from app.models.inventory import StockMove, Warehouse
 from app.models.product import Product
-from app.schemas.inventory import StockMoveCreate, StockMoveRead
-from app.api.deps import get_current_user
-from app.core.references import generate_reference
+from app.schemas.inventory import (
+    StockMoveCreate, StockMoveRead,
+    StockMoveBatchCreate, StockMoveBatchError, StockMoveBatchResult,
+    StockMoveBatchValidate, StockMoveValidationResult, StockMoveBatchValidateResult
+)
+from app.api.deps import get_async_read_session, get_current_user
+from app.core.pagination import encode_cursor, decode_cursor, NEXT_CURSOR_HEADER
+from app.core.search import search_moves
+from app.core.kpi import kpi_cache
+from app.core.metrics import MOVES_VALIDATED
+from app.core.rollups import RollupDeltas, record_status_change
+from app.core.references import generate_reference, reserve_references, get_prefix
+from app.core.stock import (
+    lock_moves, lock_products, lock_product_stocks, move_deltas, check_move,
+    apply_stock_deltas, mark_moves_done, claim_move, adjust_product_stock,
+    take_warehouse_stock, upsert_warehouse_stock, available_stock, is_low_stock
+)
 from app.models.user import User
 import logging
 
@@ -23,14 +41,17 @@ STATUS_TRANSITIONS = {
     "cancelled": ["draft"]  # Can restart from cancelled
 }
 
+MOVE_TYPES = ["IN", "OUT", "INT", "ADJ"]
+MAX_BATCH_SIZE = 5000
+
 @router.post("/moves", response_model=StockMoveRead)
-def create_stock_move(move: StockMoveCreate, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
+async def create_stock_move(move: StockMoveCreate, session: AsyncSession = Depends(get_async_session), current_user: User = Depends(get_current_user)):
     logger.info(f"🔵 CREATE MOVE - Type: {move.move_type}, Product: {move.product_id}, Qty: {move.quantity}")
     stock_move = StockMove.model_validate(move)
     
     # Generate reference automatically
     try:
-        stock_move.reference = generate_reference(move.move_type, session)
+        stock_move.reference = await session.run_sync(lambda s: generate_reference(move.move_type, s))
     except Exception as e:
         logger.error(f"Failed to generate reference: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate reference")
@@ -39,10 +60,112 @@ def create_stock_move(move: StockMoveCreate, session: Session = Depends(get_sess
     stock_move.status = "draft"
     
     session.add(stock_move)
-    session.commit()
-    session.refresh(stock_move)
+    rollup = RollupDeltas()
+    rollup.add(stock_move)
+    await session.run_sync(rollup.apply)
+    write = kpi_cache.begin_write()
+    await session.commit()
+    await session.refresh(stock_move)
+    kpi_cache.moves_created(write, {stock_move.move_type: 1})
     return stock_move
 
+def _batch_item_error(move: StockMoveCreate, product_ids: Set[int], warehouse_ids: Set[int]) -> Optional[str]:
+    """Return why a batch item can't be created, or None if it is valid"""
+    if move.move_type not in MOVE_TYPES:
+        return f"Invalid move type: {move.move_type}"
+    if move.quantity == 0 or (move.quantity < 0 and move.move_type != "ADJ"):
+        return "Quantity must be positive"
+    if move.product_id not in product_ids:
+        return "Product not found"
+    for warehouse_id in (move.source_warehouse_id, move.dest_warehouse_id):
+        if warehouse_id and warehouse_id not in warehouse_ids:
+            return f"Warehouse {warehouse_id} not found"
+    if move.move_type == "INT" and (not move.source_warehouse_id or not move.dest_warehouse_id):
+        return "Source and destination warehouses required for internal transfers"
+    return None
+
+@router.post("/moves/batch", response_model=StockMoveBatchResult)
+def create_stock_moves_batch(batch: StockMoveBatchCreate, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
+    """
+    Create many moves in one transaction.
+
+    Items are validated together (one query for products, one for warehouses),
+    references are reserved as one contiguous block per prefix, and rows are
+    written with a single multi-row INSERT. With all_or_nothing, any invalid
+    item rejects the whole batch; otherwise valid items are created and the
+    rest are reported in `errors`.
+    """
+    logger.info(f"🔵 CREATE MOVES BATCH - Items: {len(batch.moves)}, All-or-nothing: {batch.all_or_nothing}")
+    if not batch.moves:
+        raise HTTPException(status_code=400, detail="No moves provided")
+    if len(batch.moves) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch too large. Maximum: {MAX_BATCH_SIZE}")
+
+    product_ids = {m.product_id for m in batch.moves}
+    existing_products = set(session.exec(
+        select(Product.id).where(col(Product.id).in_(product_ids))
+    ).all())
+    warehouse_ids = {w for m in batch.moves for w in (m.source_warehouse_id, m.dest_warehouse_id) if w}
+    existing_warehouses = set(session.exec(
+        select(Warehouse.id).where(col(Warehouse.id).in_(warehouse_ids))
+    ).all()) if warehouse_ids else set()
+
+    errors = []
+    valid_moves = []
+    for index, move in enumerate(batch.moves):
+        detail = _batch_item_error(move, existing_products, existing_warehouses)
+        if detail:
+            errors.append(StockMoveBatchError(index=index, detail=detail))
+        else:
+            valid_moves.append(move)
+
+    if errors and batch.all_or_nothing:
+        raise HTTPException(status_code=400, detail=[e.model_dump() for e in errors])
+    if not valid_moves:
+        return StockMoveBatchResult(created=[], errors=errors)
+
+    # One contiguous block of references per prefix (IN and OUT share AW)
+    counts = {}
+    for move in valid_moves:
+        prefix = get_prefix(move.move_type)
+        counts[prefix] = counts.get(prefix, 0) + 1
+    try:
+        blocks = {}
+        for move in valid_moves:
+            prefix = get_prefix(move.move_type)
+            if prefix not in blocks:
+                blocks[prefix] = iter(reserve_references(move.move_type, session, counts[prefix]))
+    except Exception as e:
+        logger.error(f"Failed to generate references: {e}")
+        raise HTTPException(status_code=500, detail="Failed to generate reference")
+
+    created_at = datetime.utcnow()
+    rows = [
+        {
+            **move.model_dump(),
+            "reference": next(blocks[get_prefix(move.move_type)]),
+            "status": "draft",
+            "created_at": created_at
+        }
+        for move in valid_moves
+    ]
+    created_moves = session.scalars(
+        insert(StockMove).returning(StockMove, sort_by_parameter_order=True),
+        rows
+    ).all()
+
+    rollup = RollupDeltas()
+    for created_move in created_moves:
+        rollup.add(created_move)
+    rollup.apply(session)
+
+    # Build the response before commit expires the returned rows
+    created = [StockMoveRead.model_validate(m, from_attributes=True) for m in created_moves]
+    write = kpi_cache.begin_write()
+    session.commit()
+    kpi_cache.moves_created(write, Counter(m.move_type for m in created))
+    return StockMoveBatchResult(created=created, errors=errors)
+
 @router.post("/moves/{move_id}/status", response_model=StockMoveRead)
 def update_move_status(
     move_id: int, 
@@ -69,124 +192,184 @@ def update_move_status(
     
     stock_move.status = new_status
     session.add(stock_move)
+    record_status_change(session, stock_move, current_status, new_status)
+    write = kpi_cache.begin_write()
     session.commit()
     session.refresh(stock_move)
+    kpi_cache.moves_status_changed(write, {(stock_move.move_type, current_status, new_status): 1})
     return stock_move
 
 @router.post("/moves/{move_id}/validate", response_model=StockMoveRead)
-def validate_stock_move(move_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    """Validate and complete a stock move (sets status to 'done' and updates stock)"""
+async def validate_stock_move(move_id: int, session: AsyncSession = Depends(get_async_session), current_user: User = Depends(get_current_user)):
+    """
+    Validate and complete a stock move (sets status to 'done' and updates stock)
+
+    Every change is a conditional atomic UPDATE or upsert, so concurrent
+    validations can't both pass the stock check, and the same move can't be
+    validated twice. Any failure rolls back the whole transaction.
+    """
     logger.info(f"🔵 VALIDATE MOVE - Move ID: {move_id}")
-    stock_move = session.get(StockMove, move_id)
-    if not stock_move:
-        raise HTTPException(status_code=404, detail="Move not found")
-    
-    if stock_move.status == "done":
+    # The stock helpers are sync; run_sync drives them on the async connection
+    return await session.run_sync(_validate_move, move_id)
+
+def _validate_move(session: Session, move_id: int) -> StockMove:
+    claimed = claim_move(session, move_id)
+    if not claimed:
+        existing = session.get(StockMove, move_id)
+        if not existing:
+            raise HTTPException(status_code=404, detail="Move not found")
+        if existing.status == "cancelled":
+            raise HTTPException(status_code=400, detail="Cannot validate a cancelled move")
         raise HTTPException(status_code=400, detail="Move already validated")
-    
-    if stock_move.status == "cancelled":
-        raise HTTPException(status_code=400, detail="Cannot validate a cancelled move")
-    
-    product = session.get(Product, stock_move.product_id)
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
 
-    if stock_move.move_type == "IN":
-        # For receipts, update warehouse stock if warehouse is specified
-        if stock_move.source_warehouse_id:
-            warehouse_stock = session.exec(
-                select(ProductStock).where(
-                    (ProductStock.product_id == stock_move.product_id) &
-                    (ProductStock.warehouse_id == stock_move.source_warehouse_id)
-                )
-            ).first()
-            
-            if not warehouse_stock:
-                warehouse_stock = ProductStock(
-                    product_id=stock_move.product_id,
-                    warehouse_id=stock_move.source_warehouse_id,
-                    quantity=0
-                )
-                session.add(warehouse_stock)
-            
-            warehouse_stock.quantity += stock_move.quantity
-        
-        product.current_stock += stock_move.quantity
-        
-    elif stock_move.move_type == "OUT":
-        if product.current_stock < stock_move.quantity:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Insufficient stock. Available: {product.current_stock}, Required: {stock_move.quantity}"
-            )
-        product.current_stock -= stock_move.quantity
-        
-    elif stock_move.move_type == "ADJ":
-        # For adjustments, quantity can be negative or positive
-        product.current_stock += stock_move.quantity
-        
-    elif stock_move.move_type == "INT":
+    stock_move, previous_status = claimed
+    low_stock_change = 0
+    quantity = stock_move.quantity
+    product_id = stock_move.product_id
+
+    if stock_move.move_type == "INT":
         # Internal transfer between warehouses
         if not stock_move.source_warehouse_id or not stock_move.dest_warehouse_id:
             raise HTTPException(status_code=400, detail="Source and destination warehouses required for internal transfers")
-        
-        # Get source stock
-        source_stock = session.exec(
-            select(ProductStock).where(
-                (ProductStock.product_id == stock_move.product_id) &
-                (ProductStock.warehouse_id == stock_move.source_warehouse_id)
-            )
-        ).first()
-        
-        if not source_stock or source_stock.quantity < stock_move.quantity:
-            available = source_stock.quantity if source_stock else 0
+        if available_stock(session, product_id) is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+
+        # Lock both rows in key order first, so opposite transfers of a product can't deadlock
+        lock_product_stocks(session, [
+            (product_id, stock_move.source_warehouse_id), (product_id, stock_move.dest_warehouse_id)
+        ])
+        if take_warehouse_stock(session, product_id, stock_move.source_warehouse_id, quantity) is None:
+            available = available_stock(session, product_id, stock_move.source_warehouse_id) or 0
             raise HTTPException(
-                status_code=400, 
-                detail=f"Insufficient stock in source warehouse. Available: {available}, Required: {stock_move.quantity}"
+                status_code=400,
+                detail=f"Insufficient stock in source warehouse. Available: {available}, Required: {quantity}"
             )
-        
-        # Get or create dest stock
-        dest_stock = session.exec(
-            select(ProductStock).where(
-                (ProductStock.product_id == stock_move.product_id) &
-                (ProductStock.warehouse_id == stock_move.dest_warehouse_id)
-            )
-        ).first()
-        
-        if not dest_stock:
-            dest_stock = ProductStock(
-                product_id=stock_move.product_id,
-                warehouse_id=stock_move.dest_warehouse_id,
-                quantity=0
+        upsert_warehouse_stock(session, {(product_id, stock_move.dest_warehouse_id): quantity})
+
+    else:
+        product_delta, warehouse_deltas = move_deltas(stock_move)
+        # OUT must not drive stock negative; ADJ may (quantity can be negative or positive)
+        guard = stock_move.move_type == "OUT"
+        updated = adjust_product_stock(session, product_id, product_delta, guard=guard)
+        if updated is None:
+            available = available_stock(session, product_id)
+            if available is None:
+                raise HTTPException(status_code=404, detail="Product not found")
+            raise HTTPException(
+                status_code=400,
+                detail=f"Insufficient stock. Available: {available}, Required: {quantity}"
             )
-            session.add(dest_stock)
-        
-        # Update stocks
-        source_stock.quantity -= stock_move.quantity
-        dest_stock.quantity += stock_move.quantity
-        session.add(source_stock)
-        session.add(dest_stock)
-
-    stock_move.status = "done"
-    session.add(stock_move)
-    session.add(product)
+        # For receipts, update warehouse stock if warehouse is specified
+        upsert_warehouse_stock(session, warehouse_deltas)
+        current_stock, min_stock_level = updated
+        low_stock_change = (
+            is_low_stock(current_stock, min_stock_level) -
+            is_low_stock(current_stock - product_delta, min_stock_level)
+        )
+
+    record_status_change(session, stock_move, previous_status, "done")
+    write = kpi_cache.begin_write()
     session.commit()
-    session.refresh(stock_move)
-    return stock_move
+    kpi_cache.moves_status_changed(write, {(stock_move.move_type, previous_status, "done"): 1})
+    MOVES_VALIDATED.labels(stock_move.move_type).inc()
+    if low_stock_change:
+        kpi_cache.products_changed(write, low_stock=low_stock_change)
+    return session.get(StockMove, move_id)
+
+@router.post("/moves/validate-batch", response_model=StockMoveBatchValidateResult)
+def validate_stock_moves_batch(batch: StockMoveBatchValidate, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
+    """
+    Validate many moves in one transaction.
+
+    Moves, products and warehouse stock rows are locked in a fixed order, moves
+    are checked in id order against running balances (same insufficient-stock
+    rules as single validation), and the merged deltas per product and per
+    (product, warehouse) are written with set-based statements.
+    """
+    logger.info(f"🔵 VALIDATE MOVES BATCH - Items: {len(batch.move_ids)}, All-or-nothing: {batch.all_or_nothing}")
+    if not batch.move_ids:
+        raise HTTPException(status_code=400, detail="No moves provided")
+    if len(batch.move_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch too large. Maximum: {MAX_BATCH_SIZE}")
+
+    moves = lock_moves(session, batch.move_ids)
+    products = lock_products(session, {m.product_id for m in moves})
+    product_stock = {product_id: stock for product_id, (stock, _) in products.items()}
+    stock_keys = {key for m in moves for key in move_deltas(m)[1]}
+    warehouse_stock = lock_product_stocks(session, stock_keys)
+
+    results = {}
+    product_deltas = {}
+    stock_deltas = {}
+    status_changes = Counter()
+    rollup = RollupDeltas()
+    for move in moves:
+        detail = check_move(move, product_stock.get(move.product_id), warehouse_stock)
+        if detail:
+            results[move.id] = StockMoveValidationResult(move_id=move.id, success=False, detail=detail)
+            continue
+
+        product_delta, warehouse_deltas = move_deltas(move)
+        # Running balances so later moves in the batch see earlier ones
+        product_stock[move.product_id] += product_delta
+        product_deltas[move.product_id] = product_deltas.get(move.product_id, 0) + product_delta
+        for key, delta in warehouse_deltas.items():
+            warehouse_stock[key] = warehouse_stock.get(key, 0) + delta
+            stock_deltas[key] = stock_deltas.get(key, 0) + delta
+        results[move.id] = StockMoveValidationResult(move_id=move.id, success=True)
+        status_changes[(move.move_type, move.status, "done")] += 1
+        rollup.status_changed(move, move.status, "done")
+
+    ordered = [
+        results.get(move_id) or StockMoveValidationResult(move_id=move_id, success=False, detail="Move not found")
+        for move_id in dict.fromkeys(batch.move_ids)
+    ]
+    failed = [r for r in ordered if not r.success]
+    if failed and batch.all_or_nothing:
+        raise HTTPException(status_code=400, detail=[r.model_dump() for r in failed])
+
+    done_ids = [r.move_id for r in ordered if r.success]
+    apply_stock_deltas(session, product_deltas, stock_deltas)
+    mark_moves_done(session, done_ids)
+    rollup.apply(session)
+    write = kpi_cache.begin_write()
+    session.commit()
+
+    low_stock_change = sum(
+        is_low_stock(product_stock[product_id], products[product_id][1]) -
+        is_low_stock(products[product_id][0], products[product_id][1])
+        for product_id in product_deltas
+    )
+    kpi_cache.moves_status_changed(write, status_changes)
+    if low_stock_change:
+        kpi_cache.products_changed(write, low_stock=low_stock_change)
+    for (move_type, _, _), count in status_changes.items():
+        MOVES_VALIDATED.labels(move_type).inc(count)
+    return StockMoveBatchValidateResult(validated=len(done_ids), results=ordered)
 
 @router.get("/moves", response_model=List[StockMoveRead])
-def read_stock_moves(
+async def read_stock_moves(
+    response: Response,
     offset: int = 0, 
     limit: int = 100,
+    cursor: Optional[str] = None,
     move_type: Optional[str] = None,
     status: Optional[str] = None,
     search: Optional[str] = None,
-    session: Session = Depends(get_session), 
+    session: AsyncSession = Depends(get_async_read_session),
     current_user: User = Depends(get_current_user)
 ):
-    """Get stock moves with optional filtering"""
-    from sqlalchemy import or_
-    
+    """
+    Get stock moves with optional filtering
+
+    Pass the X-Next-Cursor response header back as `cursor` to fetch the next
+    page with keyset pagination (offset is then ignored). The header is only
+    set when the page is full. Plain offset/limit paging still works.
+
+    `search` matches reference, locations and product name/SKU
+    (case-insensitive) and orders results by relevance; searched listings
+    page with offset/limit only.
+    """
     query = select(StockMove)
     
     # Apply filters
@@ -197,21 +380,21 @@ def read_stock_moves(
         query = query.where(StockMove.status == status)
     
     if search:
-        # Search by reference or source/dest location
-        # SQLModel/SQLAlchemy compatible search
-        from sqlalchemy import or_
-        search_term = f"%{search}%"
-        query = query.where(
-            or_(
-                StockMove.reference.like(search_term),
-                StockMove.source_location.like(search_term),
-                StockMove.dest_location.like(search_term)
-            )
-        )
-    
-    # Order by created_at descending (newest first)
-    from sqlmodel import col
-    query = query.order_by(col(StockMove.created_at).desc())
+        if cursor:
+            raise HTTPException(status_code=400, detail="Cursor pagination is not available with search")
+        query = search_moves(query, search, session)
+    elif cursor:
+        created_at, move_id = decode_cursor(cursor)
+        query = query.where(tuple_(StockMove.created_at, StockMove.id) < tuple_(created_at, move_id))
+
+    if not cursor:
+        query = query.offset(offset)
+
+    # Order by created_at descending (newest first), id breaks ties.
+    # Served by the (created_at DESC, id DESC) index and its move_type/status variants.
+    query = query.order_by(col(StockMove.created_at).desc(), col(StockMove.id).desc())
     
-    moves = session.exec(query.offset(offset).limit(limit)).all()
+    moves = (await session.exec(query.limit(limit))).all()
+    if moves and len(moves) == limit and not search:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(moves[-1].created_at, moves[-1].id)
     return moves
@@ -1,12 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select
-from typing import List, Optional
+import json
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Response, UploadFile
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Integer, String, any_, bindparam, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlmodel import Session, col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Iterator, List, Optional
 from app.core.database import get_session
-from app.models.product import Product
+from app.models.product import DEFAULT_LOW_STOCK_THRESHOLD, Product, low_stock_predicate
 from app.models.category import Category
 from app.models.inventory import ProductStock, Warehouse
-from app.schemas.product import ProductCreate, ProductRead, ProductUpdate
-from app.api.deps import get_current_user
+from app.schemas.product import (
+    LowStockItem, ProductBulkGet, ProductCreate, ProductImportResult, ProductListRead, ProductLookupItem, ProductRead,
+    ProductUpdate, StockLocation, StockThreshold, StockThresholdUpdate
+)
+from app.api.deps import get_async_read_session, get_current_user, get_read_session
+from app.core.kpi import kpi_cache
+from app.core.pagination import NEXT_CURSOR_HEADER, decode_id_cursor, encode_id_cursor
+from app.core.product_import import FORMATS, file_format_for, run_import
+from app.core.product_index import product_index
+from app.core.stock import is_low_stock
 from app.models.user import User
 
 router = APIRouter()
@@ -52,8 +66,11 @@ def create_product(product: ProductCreate, session: Session = Depends(get_sessio
     
     new_product = Product(**product_data)
     session.add(new_product)
+    write = kpi_cache.begin_write()
     session.commit()
     session.refresh(new_product)
+    kpi_cache.products_changed(write, added=1, low_stock=is_low_stock(new_product.current_stock, new_product.min_stock_level))
+    product_index.upsert(new_product.id, new_product.sku, new_product.name)
     
     # Get category name for response
     category_name = None
@@ -73,30 +90,104 @@ def create_product(product: ProductCreate, session: Session = Depends(get_sessio
     )
     return response_data
 
-@router.get("/", response_model=List[ProductRead])
-def read_products(offset: int = 0, limit: int = 100, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    products = session.exec(select(Product).offset(offset).limit(limit)).all()
-    
-    # Get category names
-    category_ids = [p.category_id for p in products if p.category_id]
-    categories = {}
-    if category_ids:
-        # Get unique category IDs
-        unique_ids = list(set(category_ids))
-        for cat_id in unique_ids:
-            cat = session.get(Category, cat_id)
-            if cat:
-                categories[cat_id] = cat.name
-    
+@router.post("/import", response_model=ProductImportResult)
+def import_products(
+    file: UploadFile = File(...),
+    file_format: Optional[str] = Query(None, alias="format"),
+    warehouse_id: Optional[int] = None,
+    all_or_nothing: bool = True,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Create or update products in bulk from a CSV file (with a header row) or
+    a JSONL file, one JSON object per line.
+
+    Fields: sku, name and uom (required); category (a name, created if
+    missing) or category_id; min_stock_level; initial_stock and
+    warehouse_id (defaults to the warehouse_id parameter). Existing SKUs are
+    updated, keeping their stock. The format is taken from the file name
+    (.jsonl/.ndjson, otherwise CSV) unless `format` is given. With
+    all_or_nothing, any invalid row rejects the file; otherwise invalid rows
+    are skipped and reported. See app/core/product_import.py.
+    """
+    file_format = file_format or file_format_for(file.filename)
+    if file_format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format: {file_format}. Use one of: {', '.join(FORMATS)}")
+    result, low_stock_change = run_import(session, file.file, file_format, warehouse_id, all_or_nothing)
+    write = kpi_cache.begin_write()
+    session.commit()
+    kpi_cache.products_changed(write, added=result.created, low_stock=low_stock_change)
+    product_index.invalidate()
+    return result
+
+PRODUCT_INCLUDES = {"stock_by_location"}
+
+def stock_locations_query(product_ids):
+    """Per-warehouse stock of the given products, with warehouse names joined in SQL"""
+    return (
+        select(
+            ProductStock.product_id,
+            ProductStock.warehouse_id,
+            Warehouse.name.label("warehouse_name"),
+            Warehouse.location.label("warehouse_location"),
+            ProductStock.quantity
+        )
+        .join(Warehouse, Warehouse.id == ProductStock.warehouse_id)
+        .where(col(ProductStock.product_id).in_(product_ids))
+        .order_by(ProductStock.product_id, ProductStock.warehouse_id)
+    )
+
+def _stock_location(row) -> StockLocation:
+    return StockLocation(
+        warehouse_id=row.warehouse_id,
+        warehouse_name=row.warehouse_name,
+        warehouse_location=row.warehouse_location,
+        quantity=row.quantity
+    )
+
+@router.get("/", response_model=List[ProductListRead], response_model_exclude_unset=True)
+async def read_products(
+    offset: int = 0,
+    limit: int = 100,
+    include: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_read_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    List products with their category names.
+
+    `include=stock_by_location` adds each product's per-warehouse stock. The
+    page is one joined query, plus one query for the stock breakdown when
+    requested, whatever the page size.
+    """
+    includes = set(include.split(",")) if include else set()
+    if includes - PRODUCT_INCLUDES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid include: {', '.join(sorted(includes - PRODUCT_INCLUDES))}. Use: {', '.join(sorted(PRODUCT_INCLUDES))}"
+        )
+
+    rows = (await session.exec(
+        select(Product, Category.name)
+        .outerjoin(Category, Category.id == Product.category_id)
+        .order_by(Product.id)
+        .offset(offset)
+        .limit(limit)
+    )).all()
+
+    stock = None
+    if "stock_by_location" in includes:
+        stock = {product.id: [] for product, _ in rows}
+        if stock:
+            for row in (await session.exec(stock_locations_query(list(stock)))).all():
+                stock[row.product_id].append(_stock_location(row))
+
     result = []
-    for product in products:
-        category_name = None
-        if product.category_id and product.category_id in categories:
-            category_name = categories[product.category_id]
-        elif product.category:  # Fallback to old category field
-            category_name = product.category
-        
-        result.append(ProductRead(
+    for product, category_name in rows:
+        if category_name is None:
+            category_name = product.category or None  # Fallback to old category field
+        item = ProductListRead(
             id=product.id,
             name=product.name,
             sku=product.sku,
@@ -106,9 +197,187 @@ def read_products(offset: int = 0, limit: int = 100, session: Session = Depends(
             uom=product.uom,
             current_stock=product.current_stock,
             min_stock_level=product.min_stock_level
-        ))
+        )
+        if stock is not None:
+            item.stock_by_location = stock[product.id]
+        result.append(item)
     return result
 
+MAX_BULK_GET = 10_000
+BULK_GET_CHUNK_SIZE = 2000
+
+def _matching(column, values: list, item_type, dialect: str):
+    """column IN values; on PostgreSQL = ANY(one array parameter), so every chunk runs the same statement"""
+    if dialect == "postgresql":
+        return column == any_(bindparam("values", values, type_=ARRAY(item_type)))
+    return column.in_(values)
+
+def _bulk_get_chunks(ids: list, skus: list) -> Iterator[tuple]:
+    """(field, column, item type, values) for each query of a bulk get"""
+    for field, column, item_type, keys in (("id", Product.id, Integer, ids), ("sku", Product.sku, String, skus)):
+        for start in range(0, len(keys), BULK_GET_CHUNK_SIZE):
+            yield field, column, item_type, keys[start:start + BULK_GET_CHUNK_SIZE]
+
+def _bulk_get_item(row, stock: Optional[dict]) -> dict:
+    """A product line: the fields of ProductListRead, built from a column row (no ORM or model overhead)"""
+    product_id, name, sku, category_id, category, uom, current_stock, min_stock_level, category_name = row
+    if category_name is None:
+        category_name = category or None  # Fallback to old category field
+    item = {
+        "name": name,
+        "sku": sku,
+        "category_id": category_id,
+        "category": category_name,  # For backward compatibility
+        "uom": uom,
+        "min_stock_level": min_stock_level,
+        "id": product_id,
+        "current_stock": current_stock,
+        "category_name": category_name
+    }
+    if stock is not None:
+        item["stock_by_location"] = stock[product_id]
+    return item
+
+def _bulk_get_lines(session: Session, ids: List[int], skus: List[str], include_stock: bool) -> Iterator[bytes]:
+    """NDJSON for the requested products, one query (two with stock) and one chunk of output per chunk of keys"""
+    # The body is produced after the endpoint returns, so read in a connection of our own, at the Core
+    # level: plain column rows don't need ORM loading
+    with session.get_bind().connect() as connection:
+        for field, column, item_type, values in _bulk_get_chunks(ids, skus):
+            rows = connection.execute(
+                select(
+                    Product.id, Product.name, Product.sku, Product.category_id, Product.category, Product.uom,
+                    Product.current_stock, Product.min_stock_level, Category.name
+                )
+                .outerjoin(Category, Category.id == Product.category_id)
+                .where(_matching(col(column), values, item_type, connection.dialect.name))
+            ).all()
+            key = 0 if field == "id" else 2
+            found = {row[key]: row for row in rows}
+            stock = None
+            if include_stock and found:
+                stock = {row[0]: [] for row in rows}
+                for product_id, warehouse_id, warehouse_name, warehouse_location, quantity in connection.execute(
+                    stock_locations_query(list(stock))
+                ):
+                    stock[product_id].append({
+                        "warehouse_id": warehouse_id,
+                        "warehouse_name": warehouse_name,
+                        "warehouse_location": warehouse_location,
+                        "quantity": quantity
+                    })
+            lines = [
+                json.dumps(_bulk_get_item(found[value], stock) if value in found else {"not_found": {field: value}})
+                for value in values
+            ]
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+
+@router.post("/bulk-get")
+def bulk_get_products(
+    request: ProductBulkGet,
+    session: Session = Depends(get_read_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Fetch up to 10,000 products by id and/or SKU in one request, for
+    integrations that reconcile stock. The response is NDJSON: one line per
+    requested id, then per requested SKU, in request order (duplicates
+    dropped). A product line has the fields of GET /products/, with
+    stock_by_location when include_stock is set; a key that matches no
+    product gives a {"not_found": {"id": ...}} or {"not_found": {"sku": ...}}
+    line. Rows are fetched BULK_GET_CHUNK_SIZE keys per query and streamed as
+    each chunk is ready.
+    """
+    ids = list(dict.fromkeys(request.ids))
+    skus = list(dict.fromkeys(request.skus))
+    if len(ids) + len(skus) > MAX_BULK_GET:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_GET} ids and SKUs per request")
+    return StreamingResponse(
+        _bulk_get_lines(session, ids, skus, request.include_stock),
+        media_type="application/x-ndjson"
+    )
+
+MAX_LOW_STOCK_PAGE = 1000
+
+@router.get("/low-stock", response_model=List[LowStockItem], response_model_exclude_none=True)
+async def read_low_stock(
+    response: Response,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    warehouse_id: Optional[int] = None,
+    session: AsyncSession = Depends(get_async_read_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Products below their low-stock threshold, in id order: current_stock <
+    min_stock_level, or < 10 when unset. With warehouse_id, the products
+    whose quantity in that warehouse is below the warehouse's min_quantity
+    (set with PUT /products/{id}/stock-locations/{warehouse_id}/threshold).
+
+    Each page is a range scan of a partial index holding only the low-stock
+    rows (ix_product_low_stock, ix_productstock_low_stock), which the
+    database keeps current on every stock or threshold change, so a page
+    costs the same however large the catalog is. Pass the X-Next-Cursor
+    response header back as `cursor` for the next page; it is only set when
+    the page is full.
+    """
+    if not 1 <= limit <= MAX_LOW_STOCK_PAGE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_LOW_STOCK_PAGE}")
+    after_id = decode_id_cursor(cursor) if cursor else 0
+
+    if warehouse_id is None:
+        rows = (await session.exec(
+            select(
+                Product.id, Product.sku, Product.name, Product.current_stock,
+                func.coalesce(Product.min_stock_level, DEFAULT_LOW_STOCK_THRESHOLD)
+            )
+            .where(low_stock_predicate(), Product.id > after_id)
+            .order_by(Product.id)
+            .limit(limit)
+        )).all()
+        items = [
+            LowStockItem(id=id, sku=sku, name=name, current_stock=current_stock, threshold=threshold)
+            for id, sku, name, current_stock, threshold in rows
+        ]
+    else:
+        rows = (await session.exec(
+            select(Product.id, Product.sku, Product.name, ProductStock.quantity, ProductStock.min_quantity)
+            .join(Product, Product.id == ProductStock.product_id)
+            # The same predicate as ix_productstock_low_stock, so the index serves it
+            .where(
+                ProductStock.warehouse_id == warehouse_id,
+                ProductStock.quantity < ProductStock.min_quantity,
+                ProductStock.product_id > after_id
+            )
+            .order_by(ProductStock.product_id)
+            .limit(limit)
+        )).all()
+
+        items = [
+            LowStockItem(
+                id=id, sku=sku, name=name, current_stock=quantity, threshold=min_quantity, warehouse_id=warehouse_id
+            )
+            for id, sku, name, quantity, min_quantity in rows
+        ]
+
+    if items and len(items) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_id_cursor(items[-1].id)
+    return items
+
+MAX_LOOKUP_RESULTS = 50
+
+@router.get("/lookup", response_model=List[ProductLookupItem])
+async def lookup_products(q: str, limit: int = 10, current_user: User = Depends(get_current_user)):
+    """
+    Typeahead for product pickers: products whose SKU, then name, starts
+    with q (case-insensitive). Served from this worker's in-memory index
+    (app/core/product_index.py) without touching the database; a product
+    written in another worker may take a few seconds to show up.
+    """
+    if not 1 <= limit <= MAX_LOOKUP_RESULTS:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_LOOKUP_RESULTS}")
+    return [ProductLookupItem(id=id, sku=sku, name=name) for id, sku, name in product_index.lookup(q, limit)]
+
 @router.get("/{product_id}", response_model=ProductRead)
 def read_product(product_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
     product = session.get(Product, product_id)
@@ -140,6 +409,8 @@ def update_product(product_id: int, product_update: ProductUpdate, session: Sess
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    was_low_stock = is_low_stock(product.current_stock, product.min_stock_level)
+
     # Handle category update
     if product_update.category_id is not None or product_update.category:
         category_id = get_category_id(session, product_update.category_id, product_update.category)
@@ -150,8 +421,14 @@ def update_product(product_id: int, product_update: ProductUpdate, session: Sess
         setattr(product, field, value)
     
     session.add(product)
+    write = kpi_cache.begin_write()
     session.commit()
     session.refresh(product)
+    low_stock_change = is_low_stock(product.current_stock, product.min_stock_level) - was_low_stock
+    if low_stock_change:
+        kpi_cache.products_changed(write, low_stock=low_stock_change)
+    if "name" in update_data:
+        product_index.upsert(product.id, product.sku, product.name)
     
     category_name = None
     if product.category_id:
@@ -175,8 +452,12 @@ def delete_product(product_id: int, session: Session = Depends(get_session), cur
     product = session.get(Product, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    was_low_stock = is_low_stock(product.current_stock, product.min_stock_level)
     session.delete(product)
+    write = kpi_cache.begin_write()
     session.commit()
+    kpi_cache.products_changed(write, added=-1, low_stock=-was_low_stock)
+    product_index.remove(product_id)
     return {"message": "Product deleted successfully"}
 
 @router.get("/{product_id}/stock-locations")
@@ -186,24 +467,10 @@ def get_product_stock_locations(product_id: int, session: Session = Depends(get_
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Get all stock entries for this product
-    stock_entries = session.exec(
-        select(ProductStock).where(ProductStock.product_id == product_id)
-    ).all()
-    
-    # Get warehouse details
-    warehouses = {w.id: w for w in session.exec(select(Warehouse)).all()}
-    
-    result = []
-    for stock in stock_entries:
-        warehouse = warehouses.get(stock.warehouse_id)
-        if warehouse:
-            result.append({
-                "warehouse_id": stock.warehouse_id,
-                "warehouse_name": warehouse.name,
-                "warehouse_location": warehouse.location,
-                "quantity": stock.quantity
-            })
+    result = [
+        _stock_location(row).model_dump()
+        for row in session.exec(stock_locations_query([product_id])).all()
+    ]
     
     return {
         "product_id": product_id,
@@ -211,3 +478,33 @@ def get_product_stock_locations(product_id: int, session: Session = Depends(get_
         "total_stock": product.current_stock,
         "stock_by_location": result
     }
+
+@router.put("/{product_id}/stock-locations/{warehouse_id}/threshold", response_model=StockThreshold)
+def set_stock_threshold(
+    product_id: int,
+    warehouse_id: int,
+    threshold: StockThresholdUpdate,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """Set or clear the product's low-stock threshold in one warehouse (see GET /products/low-stock)"""
+    if not session.get(Product, product_id):
+        raise HTTPException(status_code=404, detail="Product not found")
+    if not session.get(Warehouse, warehouse_id):
+        raise HTTPException(status_code=404, detail="Warehouse not found")
+    if threshold.min_quantity is not None and threshold.min_quantity < 0:
+        raise HTTPException(status_code=400, detail="min_quantity must not be negative")
+    # Upsert on the (product_id, warehouse_id) key: a threshold can be set before any stock arrives
+    dialect = session.get_bind().dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert(ProductStock.__table__).values(
+        product_id=product_id, warehouse_id=warehouse_id, quantity=0, min_quantity=threshold.min_quantity
+    )
+    row = session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["product_id", "warehouse_id"],
+            set_={"min_quantity": stmt.excluded.min_quantity}
+        ).returning(ProductStock.__table__.c.quantity, ProductStock.__table__.c.min_quantity)
+    ).one()
+    session.commit()
+    return StockThreshold(product_id=product_id, warehouse_id=warehouse_id, quantity=row.quantity, min_quantity=row.min_quantity)
@@ -1,103 +1,203 @@
-from fastapi import APIRouter, Depends, Response
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import aliased
 from sqlmodel import Session, select
-from app.core.database import get_session
+from typing import List, Optional
+from datetime import date
+from app.core.exports import iter_batches, csv_chunks, csv_response, filter_moves, parquet_response
+from app.core.rollups import BUCKETS, movement_trends
 from app.models.product import Product
 from app.models.inventory import StockMove, ProductStock, Warehouse
-from app.api.deps import get_current_user
+from app.api.deps import get_current_user, get_read_session
 from app.models.user import User
-import csv
-import io
+from app.schemas.inventory import MovementTrendPoint
 
 router = APIRouter()
 
+SourceWarehouse = aliased(Warehouse)
+DestWarehouse = aliased(Warehouse)
+
+def stock_moves_query():
+    """Stock moves with product and warehouse names joined in SQL"""
+    return (
+        select(
+            StockMove.id,
+            StockMove.product_id,
+            Product.name.label("product_name"),
+            StockMove.move_type,
+            StockMove.quantity,
+            StockMove.source_location,
+            StockMove.source_warehouse_id,
+            SourceWarehouse.name.label("source_warehouse"),
+            StockMove.dest_location,
+            StockMove.dest_warehouse_id,
+            DestWarehouse.name.label("dest_warehouse"),
+            StockMove.status,
+            StockMove.created_at
+        )
+        .outerjoin(Product, Product.id == StockMove.product_id)
+        .outerjoin(SourceWarehouse, SourceWarehouse.id == StockMove.source_warehouse_id)
+        .outerjoin(DestWarehouse, DestWarehouse.id == StockMove.dest_warehouse_id)
+        .order_by(StockMove.id)
+    )
+
+def warehouse_stock_query(warehouse_id: Optional[int] = None):
+    """Warehouse stock with product and warehouse names joined in SQL"""
+    query = (
+        select(
+            ProductStock.product_id,
+            Product.name.label("product_name"),
+            ProductStock.warehouse_id,
+            Warehouse.name.label("warehouse_name"),
+            Warehouse.location.label("warehouse_location"),
+            ProductStock.quantity
+        )
+        .outerjoin(Product, Product.id == ProductStock.product_id)
+        .outerjoin(Warehouse, Warehouse.id == ProductStock.warehouse_id)
+        .order_by(ProductStock.id)
+    )
+    if warehouse_id:
+        query = query.where(ProductStock.warehouse_id == warehouse_id)
+    return query
+
+# Parquet column kinds, in query order (see exports.parquet_chunks)
+STOCK_MOVE_COLUMNS = [
+    ("id", "int"),
+    ("product_id", "int"),
+    ("product_name", "string"),
+    ("move_type", "category"),
+    ("quantity", "int"),
+    ("source_location", "string"),
+    ("source_warehouse_id", "int"),
+    ("source_warehouse", "category"),
+    ("dest_location", "string"),
+    ("dest_warehouse_id", "int"),
+    ("dest_warehouse", "category"),
+    ("status", "category"),
+    ("created_at", "timestamp")
+]
+
+WAREHOUSE_STOCK_COLUMNS = [
+    ("product_id", "int"),
+    ("product_name", "string"),
+    ("warehouse_id", "int"),
+    ("warehouse_name", "category"),
+    ("warehouse_location", "category"),
+    ("quantity", "int")
+]
+
+def _location(location, warehouse_name, warehouse_id):
+    return location or warehouse_name or (f"WH#{warehouse_id}" if warehouse_id else "")
+
 @router.get("/products/csv")
-def export_products_csv(session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    products = session.exec(select(Product)).all()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['ID', 'Name', 'SKU', 'Category', 'UoM', 'Current Stock'])
-    
-    for p in products:
-        writer.writerow([p.id, p.name, p.sku, p.category, p.uom, p.current_stock])
-    
-    output.seek(0)
-    csv_content = output.getvalue()
-    output.close()
-    
-    return StreamingResponse(
-        iter([csv_content]),
-        media_type="text/csv; charset=utf-8",
-        headers={
-            "Content-Disposition": "attachment; filename=products.csv",
-            "Content-Type": "text/csv; charset=utf-8"
-        }
+def export_products_csv(gzip: bool = False, session: Session = Depends(get_read_session), current_user: User = Depends(get_current_user)):
+    query = select(
+        Product.id, Product.name, Product.sku, Product.category, Product.uom, Product.current_stock
+    ).order_by(Product.id)
+    chunks = csv_chunks(
+        ['ID', 'Name', 'SKU', 'Category', 'UoM', 'Current Stock'],
+        iter_batches(session, query),
+        tuple
     )
+    return csv_response(chunks, "products.csv", gzip)
 
 @router.get("/stock-moves/csv")
-def export_stock_moves_csv(session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    moves = session.exec(select(StockMove)).all()
-    products = {p.id: p for p in session.exec(select(Product)).all()}
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['ID', 'Product', 'Type', 'Quantity', 'Source', 'Destination', 'Status', 'Created At'])
-    
-    for m in moves:
-        product_name = products.get(m.product_id).name if m.product_id in products else f"Product #{m.product_id}"
-        source = m.source_location or (f"WH#{m.source_warehouse_id}" if m.source_warehouse_id else "")
-        dest = m.dest_location or (f"WH#{m.dest_warehouse_id}" if m.dest_warehouse_id else "")
-        writer.writerow([
-            m.id, 
-            product_name, 
-            m.move_type, 
-            m.quantity, 
-            source,
-            dest,
-            m.status,
-            m.created_at.strftime('%Y-%m-%d %H:%M:%S') if m.created_at else ""
-        ])
-    
-    output.seek(0)
-    csv_content = output.getvalue()
-    output.close()
-    
-    return StreamingResponse(
-        iter([csv_content]),
-        media_type="text/csv; charset=utf-8",
-        headers={
-            "Content-Disposition": "attachment; filename=stock_moves.csv",
-            "Content-Type": "text/csv; charset=utf-8"
-        }
+def export_stock_moves_csv(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    move_type: Optional[str] = None,
+    status: Optional[str] = None,
+    warehouse_id: Optional[int] = None,
+    gzip: bool = False,
+    session: Session = Depends(get_read_session),
+    current_user: User = Depends(get_current_user)
+):
+    query = filter_moves(stock_moves_query(), date_from, date_to, move_type, status, warehouse_id)
+
+    def format_row(m):
+        (move_id, product_id, product_name, move_type, quantity, source_location, source_warehouse_id,
+         source_warehouse, dest_location, dest_warehouse_id, dest_warehouse, move_status, created_at) = m
+        return [
+            move_id,
+            product_name or f"Product #{product_id}",
+            move_type,
+            quantity,
+            _location(source_location, source_warehouse, source_warehouse_id),
+            _location(dest_location, dest_warehouse, dest_warehouse_id),
+            move_status,
+            created_at.isoformat(sep=' ', timespec='seconds') if created_at else ""
+        ]
+
+    chunks = csv_chunks(
+        ['ID', 'Product', 'Type', 'Quantity', 'Source', 'Destination', 'Status', 'Created At'],
+        iter_batches(session, query),
+        format_row
     )
+    return csv_response(chunks, "stock_moves.csv", gzip)
 
 @router.get("/warehouse-stock/csv")
-def export_warehouse_stock_csv(session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    stocks = session.exec(select(ProductStock)).all()
-    products = {p.id: p for p in session.exec(select(Product)).all()}
-    warehouses = {w.id: w for w in session.exec(select(Warehouse)).all()}
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Product', 'Warehouse', 'Location', 'Quantity'])
-    
-    for s in stocks:
-        product_name = products.get(s.product_id).name if s.product_id in products else f"Product #{s.product_id}"
-        warehouse = warehouses.get(s.warehouse_id)
-        warehouse_name = warehouse.name if warehouse else f"WH#{s.warehouse_id}"
-        warehouse_location = warehouse.location if warehouse else ""
-        writer.writerow([product_name, warehouse_name, warehouse_location, s.quantity])
-    
-    output.seek(0)
-    csv_content = output.getvalue()
-    output.close()
-    
-    return StreamingResponse(
-        iter([csv_content]),
-        media_type="text/csv; charset=utf-8",
-        headers={
-            "Content-Disposition": "attachment; filename=warehouse_stock.csv",
-            "Content-Type": "text/csv; charset=utf-8"
-        }
+def export_warehouse_stock_csv(
+    warehouse_id: Optional[int] = None,
+    gzip: bool = False,
+    session: Session = Depends(get_read_session),
+    current_user: User = Depends(get_current_user)
+):
+    def format_row(s):
+        return [
+            s.product_name or f"Product #{s.product_id}",
+            s.warehouse_name or f"WH#{s.warehouse_id}",
+            s.warehouse_location or "",
+            s.quantity
+        ]
+
+    chunks = csv_chunks(
+        ['Product', 'Warehouse', 'Location', 'Quantity'],
+        iter_batches(session, warehouse_stock_query(warehouse_id)),
+        format_row
     )
+    return csv_response(chunks, "warehouse_stock.csv", gzip)
+
+@router.get("/stock-moves/parquet")
+def export_stock_moves_parquet(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    move_type: Optional[str] = None,
+    status: Optional[str] = None,
+    warehouse_id: Optional[int] = None,
+    session: Session = Depends(get_read_session),
+    current_user: User = Depends(get_current_user)
+):
+    query = filter_moves(stock_moves_query(), date_from, date_to, move_type, status, warehouse_id)
+    return parquet_response(STOCK_MOVE_COLUMNS, iter_batches(session, query), "stock_moves.parquet")
+
+@router.get("/warehouse-stock/parquet")
+def export_warehouse_stock_parquet(
+    warehouse_id: Optional[int] = None,
+    session: Session = Depends(get_read_session),
+    current_user: User = Depends(get_current_user)
+):
+    return parquet_response(
+        WAREHOUSE_STOCK_COLUMNS, iter_batches(session, warehouse_stock_query(warehouse_id)), "warehouse_stock.parquet"
+    )
+
+@router.get("/movement-trends", response_model=List[MovementTrendPoint])
+def read_movement_trends(
+    bucket: str = "day",
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    product_id: Optional[int] = None,
+    warehouse_id: Optional[int] = None,
+    move_type: Optional[str] = None,
+    status: Optional[str] = None,
+    session: Session = Depends(get_read_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Move counts and quantities per day, week (starting Monday) or month and
+    move type, by move creation date. Answered from the daily rollup table;
+    buckets without moves are omitted.
+    """
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Invalid bucket: {bucket}. Use one of: {', '.join(BUCKETS)}")
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+    return movement_trends(session, bucket, date_from, date_to, product_id, warehouse_id, move_type, status)
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from app.api.deps import get_current_admin, get_current_user
+from app.core.database import named_engines
+from app.core.db_metrics import pool_stats
+from app.core.profiling import PROFILE_SUFFIX, list_profiles, profile_path
+from app.models.user import User
+
+router = APIRouter()
+
+@router.get("/db-pool")
+def get_db_pool_stats(current_user: User = Depends(get_current_user)):
+    """
+    Connection pool usage and checkout wait histogram for this worker.
+
+    Buckets are cumulative counts of checkouts that waited at most that many
+    seconds. Frequent waits in the upper buckets, or any timeouts, mean the
+    pool is too small for the load (or connections are held too long).
+    """
+    return pool_stats(named_engines())
+
+@router.get("/profiles")
+def get_profiles(current_user: User = Depends(get_current_admin)):
+    """Saved request profiles of this host, newest first (see app/core/profiling.py)"""
+    return list_profiles()
+
+@router.get("/profiles/{profile_id}")
+def download_profile(profile_id: str, current_user: User = Depends(get_current_admin)):
+    """Download a profile as speedscope JSON (open it at https://www.speedscope.app)"""
+    path = profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=f"{profile_id}{PROFILE_SUFFIX}")
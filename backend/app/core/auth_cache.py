@@ -0,0 +1,80 @@
+"""
+Per-worker cache for get_current_user.
+
+Every authenticated request used to decode its JWT and load the user by
+email. Both results are cached here: the decoded claims by token, and a
+snapshot of the user's fields (without the password hash) by user id. Tokens
+carry the user id in the "uid" claim; tokens issued before that are resolved
+by email once and then cached the same way.
+
+Entries live for AUTH_CACHE_TTL_SECONDS at most, and never past the token's
+own expiry. Each map holds at most AUTH_CACHE_SIZE entries, evicting the
+least recently used. PUT /auth/me and reset-password drop the user's snapshot
+in this worker; other workers see the change when their entry expires.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.models.user import User
+
+SNAPSHOT_FIELDS = ("id", "email", "full_name", "role")
+
+class AuthCache:
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._claims: OrderedDict = OrderedDict()  # token -> (expires_at, claims)
+        self._users: OrderedDict = OrderedDict()  # user id -> (expires_at, snapshot)
+
+    def _get(self, entries: OrderedDict, key: Any) -> Optional[dict]:
+        with self._lock:
+            entry = entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del entries[key]
+                return None
+            entries.move_to_end(key)
+            return value
+
+    def _put(self, entries: OrderedDict, key: Any, value: dict, lifetime: float) -> None:
+        if lifetime <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            entries[key] = (time.monotonic() + lifetime, value)
+            entries.move_to_end(key)
+            while len(entries) > self.max_size:
+                entries.popitem(last=False)
+
+    def get_claims(self, token: str) -> Optional[dict]:
+        return self._get(self._claims, token)
+
+    def store_claims(self, token: str, claims: dict) -> None:
+        lifetime = self.ttl_seconds
+        if claims.get("exp") is not None:
+            lifetime = min(lifetime, claims["exp"] - time.time())
+        self._put(self._claims, token, claims, lifetime)
+
+    def get_user(self, user_id: int) -> Optional[dict]:
+        return self._get(self._users, user_id)
+
+    def store_user(self, user: User) -> Dict[str, Any]:
+        snapshot = {field: getattr(user, field) for field in SNAPSHOT_FIELDS}
+        self._put(self._users, user.id, snapshot, self.ttl_seconds)
+        return snapshot
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._claims.clear()
+            self._users.clear()
+
+auth_cache = AuthCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL_SECONDS)
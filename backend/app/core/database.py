@@ -1,14 +1,109 @@
+from typing import Dict
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.core.config import settings
+from app.core.db_metrics import TimedAsyncQueuePool, TimedQueuePool, instrument
 
 # Import all models to ensure they're registered with SQLModel
-from app.models import user, product, inventory, vendor, customer, category, otp
+from app.models import user, product, inventory, vendor, customer, category, otp, sequence, rollup, outbox
 
-engine = create_engine(settings.DATABASE_URL, echo=True)  # SQL logging enabled
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+def async_database_url(url: str) -> str:
+    """The same database as DATABASE_URL, addressed through its asyncio driver"""
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver configured for {url.get_backend_name()}")
+    return url.set(drivername=f"{url.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+def engine_options(url: str, is_async: bool = False) -> dict:
+    """create_engine() arguments from the DB_* settings"""
+    url = make_url(url)
+    options = {"echo": settings.DB_ECHO, "pool_pre_ping": settings.DB_POOL_PRE_PING}
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options  # In-memory SQLite keeps its single shared connection
+    options.update(
+        poolclass=TimedAsyncQueuePool if is_async else TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=settings.DB_POOL_RECYCLE_SECONDS
+    )
+    if url.get_backend_name() == "postgresql" and settings.DB_STATEMENT_TIMEOUT_MS:
+        timeout = str(settings.DB_STATEMENT_TIMEOUT_MS)
+        options["connect_args"] = (
+            {"server_settings": {"statement_timeout": timeout}} if is_async
+            else {"options": f"-c statement_timeout={timeout}"}
+        )
+    return options
+
+engine = create_engine(settings.DATABASE_URL, **engine_options(settings.DATABASE_URL))
+
+# Hot endpoints are async and use this engine; the rest run on the sync
+# engine in FastAPI's threadpool. Both point at the same database, and each
+# has its own pool of DB_POOL_SIZE + DB_MAX_OVERFLOW connections per worker.
+async_engine = create_async_engine(
+    async_database_url(settings.DATABASE_URL), **engine_options(settings.DATABASE_URL, is_async=True)
+)
+
+instrument(engine, "sync")
+instrument(async_engine.sync_engine, "async")
+
+# List and report reads go to READ_DATABASE_URL when it is set, through the
+# read dependencies in deps.py (see app/core/replica.py). Without it these
+# are the primary engines.
+if settings.READ_DATABASE_URL:
+    read_engine = create_engine(settings.READ_DATABASE_URL, **engine_options(settings.READ_DATABASE_URL))
+    async_read_engine = create_async_engine(
+        async_database_url(settings.READ_DATABASE_URL), **engine_options(settings.READ_DATABASE_URL, is_async=True)
+    )
+    instrument(read_engine, "read_sync")
+    instrument(async_read_engine.sync_engine, "read_async")
+else:
+    read_engine, async_read_engine = engine, async_engine
+
+def named_engines() -> Dict[str, Engine]:
+    """This worker's sync engines by metrics label"""
+    engines = {"sync": engine, "async": async_engine.sync_engine}
+    if read_engine is not engine:
+        engines.update(read_sync=read_engine, read_async=async_read_engine.sync_engine)
+    return engines
 
 def get_session():
     with Session(engine) as session:
         yield session
 
+async def get_async_session():
+    # Instances stay loaded after commit, as in the sync endpoints' responses
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+def get_replica_session():
+    with Session(read_engine) as session:
+        yield session
+
+async def get_async_replica_session():
+    async with AsyncSession(async_read_engine, expire_on_commit=False) as session:
+        yield session
+
+def release_connection(session: Session, *instances):
+    """
+    End the session's transaction so its connection goes back to the pool,
+    keeping the given instances loaded (detached; session.add() re-attaches
+    them). Async endpoints call this before awaiting slow non-database work.
+    """
+    for instance in instances:
+        session.expunge(instance)
+    session.rollback()
+
+async def release_async_connection(session: AsyncSession, *instances):
+    """release_connection() for an AsyncSession"""
+    for instance in instances:
+        session.expunge(instance)
+    await session.rollback()
+
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
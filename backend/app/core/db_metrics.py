@@ -0,0 +1,255 @@
+"""
+Database instrumentation: per-request query metrics, slow-query log and
+pool checkout wait times.
+
+RequestMetricsMiddleware keeps a RequestMetrics for the current request in
+a context variable; the cursor listeners add each statement's count and
+duration to it. With REQUEST_METRICS on, responses carry a Server-Timing
+header splitting the time until the response started into database and
+application (Python, serialization) time, and requests that run more than
+QUERY_BUDGET statements are logged, which is how N+1 loops show up. With
+REQUEST_METRICS off and SLOW_QUERY_MS at 0 no listener is installed.
+
+Statements slower than SLOW_QUERY_MS are logged on the "app.sql.slow"
+logger with their duration, the route that issued them and the shape of
+their parameters (types and counts, never values). Statements run outside
+a request are reported as "-".
+
+Every engine built by database.py uses a pool that times each checkout.
+The wait covers queueing for a free connection and, while the pool is
+below its limit, opening a new one. pool_stats() returns the counts,
+cumulative wait buckets and current pool usage for each engine; the same
+figures are exported to Prometheus (see app/core/metrics.py).
+"""
+import bisect
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.datastructures import MutableHeaders
+
+from app.core.config import settings
+from app.core.metrics import DB_POOL_CHECKED_OUT, DB_POOL_CHECKOUT_WAIT, DB_POOL_OVERFLOW, DB_POOL_SIZE
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("app.sql.slow")
+
+# Upper bounds of the checkout wait buckets, in seconds
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+MAX_LOGGED_STATEMENT = 2000
+
+class RequestMetrics:
+    """Statements run so far by one request, and their total time"""
+
+    __slots__ = ("scope", "started", "queries", "db_seconds")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+
+    def route(self) -> str:
+        """Method and route template, e.g. "GET /products/{product_id}" """
+        # The router adds the matched route to the scope; before that, use the raw path
+        route = self.scope.get("route")
+        return f"{self.scope['method']} {getattr(route, 'path', self.scope['path'])}"
+
+    def server_timing(self) -> str:
+        total_ms = (time.perf_counter() - self.started) * 1000
+        db_ms = self.db_seconds * 1000
+        return f'db;dur={db_ms:.1f};desc="{self.queries} queries", app;dur={max(total_ms - db_ms, 0):.1f}'
+
+_request: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+class RequestMetricsMiddleware:
+    """Tracks RequestMetrics for each HTTP request (pure ASGI, no buffering)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request = RequestMetrics(scope)
+        token = _request.set(request)
+        try:
+            if not settings.REQUEST_METRICS:
+                return await self.app(scope, receive, send)
+
+            async def send_with_timing(message):
+                if message["type"] == "http.response.start":
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", request.server_timing())
+                    # Lets the cross-origin frontend's devtools show the timings
+                    headers.append("Timing-Allow-Origin", "*")
+                await send(message)
+
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request.reset(token)
+            # Counted to the end, including statements run while streaming the body
+            if settings.REQUEST_METRICS and settings.QUERY_BUDGET and request.queries > settings.QUERY_BUDGET:
+                logger.warning(
+                    f"{request.route()} ran {request.queries} queries "
+                    f"({request.db_seconds * 1000:.1f} ms in the database), over the budget of {settings.QUERY_BUDGET}"
+                )
+
+def current_route() -> str:
+    """Method and route template of the request being served, or "-" outside a request"""
+    request = _request.get()
+    return request.route() if request is not None else "-"
+
+def _describe_values(values) -> str:
+    """Type names with runs collapsed, e.g. "int, str*3" """
+    runs: List[List] = []
+    for value in values:
+        name = type(value).__name__
+        if runs and runs[-1][0] == name:
+            runs[-1][1] += 1
+        else:
+            runs.append([name, 1])
+    return ", ".join(name if count == 1 else f"{name}*{count}" for name, count in runs)
+
+def parameters_shape(parameters, executemany: bool) -> str:
+    if executemany:
+        rows = list(parameters)
+        return f"{len(rows)} rows of {parameters_shape(rows[0], False)}" if rows else "0 rows"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return f"({_describe_values(parameters)})"
+    return type(parameters).__name__
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    request = _request.get()
+    if request is not None:
+        request.queries += 1
+        request.db_seconds += elapsed
+    elapsed_ms = elapsed * 1000
+    if settings.SLOW_QUERY_MS and elapsed_ms >= settings.SLOW_QUERY_MS:
+        if len(statement) > MAX_LOGGED_STATEMENT:
+            statement = statement[:MAX_LOGGED_STATEMENT] + "..."
+        slow_query_logger.warning(
+            f"Slow query ({elapsed_ms:.1f} ms) on {current_route()}: {' '.join(statement.split())} "
+            f"-- parameters {parameters_shape(parameters, executemany)}"
+        )
+
+def instrument(engine: Engine, name: str) -> None:
+    """Attach the listeners to a sync engine (for an async engine, its sync_engine); name labels its metrics"""
+    if isinstance(engine.pool, _TimedCheckout):
+        engine.pool.waits.name = name
+        DB_POOL_SIZE.labels(name).set(engine.pool.size())
+
+        checked_out = DB_POOL_CHECKED_OUT.labels(name)
+        overflow = DB_POOL_OVERFLOW.labels(name)
+
+        def on_checkout(*args):
+            checked_out.inc()
+            # The pool only grows on checkout, so this is where overflow changes upward
+            overflow.set(max(engine.pool.overflow(), 0))
+
+        event.listen(engine, "checkout", on_checkout)
+        event.listen(engine, "checkin", lambda *args: checked_out.dec())
+    if settings.REQUEST_METRICS or settings.SLOW_QUERY_MS:
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+class CheckoutWaits:
+    """Cumulative histogram of pool checkout waits, in the Prometheus bucket layout"""
+
+    def __init__(self):
+        self.name: Optional[str] = None  # Engine label for the Prometheus histogram
+        self._lock = threading.Lock()
+        self.bucket_counts = [0] * len(WAIT_BUCKETS)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.timeouts = 0
+
+    def observe(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            index = bisect.bisect_left(WAIT_BUCKETS, seconds)
+            if index < len(self.bucket_counts):
+                self.bucket_counts[index] += 1
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            if timed_out:
+                self.timeouts += 1
+        if self.name:
+            DB_POOL_CHECKOUT_WAIT.labels(self.name).observe(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            cumulative, buckets = 0, {}
+            for bound, count in zip(WAIT_BUCKETS, self.bucket_counts):
+                cumulative += count
+                buckets[bound] = cumulative
+            return {
+                "count": self.count,
+                "sum_seconds": self.total_seconds,
+                "max_seconds": self.max_seconds,
+                "timeouts": self.timeouts,
+                "buckets": buckets
+            }
+
+class _TimedCheckout:
+    """Mixin for QueuePool subclasses: time every checkout"""
+
+    waits: CheckoutWaits
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception as e:
+            self.waits.observe(time.perf_counter() - started, timed_out="TimeoutError" in type(e).__name__)
+            raise
+        self.waits.observe(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        # dispose() and invalidation rebuild the pool; keep counting into the same histogram
+        pool = super().recreate()
+        pool.waits = self.waits
+        return pool
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = CheckoutWaits()
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = CheckoutWaits()
+
+def pool_stats(engines: Dict[str, Engine]) -> Dict[str, dict]:
+    """Checkout waits and current usage for each named engine"""
+    stats = {}
+    for name, engine in engines.items():
+        pool = engine.pool
+        if not isinstance(pool, _TimedCheckout):
+            continue
+        stats[name] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,
+            "checkout_wait": pool.waits.snapshot()
+        }
+    return stats
@@ -1,26 +1,59 @@
-import smtplib
-from email.mime.text import MIMEText
+"""
+OTP email delivery through a persistent outbox.
+
+Endpoints never talk to the mail server. queue_otp_email() adds an
+EmailOutbox row to the caller's session, so the message is committed together
+with the OTP, and mail_queue.wake() tells the delivery worker. The worker
+(MailQueue, started in the app lifespan) claims due messages in batches,
+sends them over one reused, authenticated aiosmtplib connection, and retries
+failures with exponential backoff up to OUTBOX_MAX_ATTEMPTS.
+
+Messages live in the database, so a restart doesn't lose them. Claiming a
+message sets next_attempt_at a lease ahead; if a worker dies mid-send, the
+message becomes due again when the lease runs out. Each uvicorn worker runs
+its own queue, and claiming is a conditional UPDATE, so only one of them
+sends a given message.
+
+To test locally, run a stand-in server such as
+`python -m aiosmtpd -n -l localhost:1025` and set SMTP_HOST=localhost,
+SMTP_PORT=1025, SMTP_STARTTLS=false, SMTP_AUTH=false and SMTP_FROM_EMAIL.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
 from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Dict, List, Optional, Tuple
+
+import aiosmtplib
+from sqlalchemy import update
+from sqlmodel import Session, select, col
+from sqlmodel.ext.asyncio.session import AsyncSession
+
 from app.core.config import settings
-import logging
+from app.core.database import engine
+from app.models.outbox import EmailOutbox
 
 logger = logging.getLogger(__name__)
 
-def send_otp_email(email: str, otp_code: str) -> bool:
-    """Send OTP code via email using Gmail SMTP"""
-    try:
-        if not settings.SMTP_USER or not settings.SMTP_PASSWORD:
-            logger.error("SMTP credentials not configured")
-            return False
-        
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = settings.SMTP_FROM_EMAIL or settings.SMTP_USER
-        msg['To'] = email
-        msg['Subject'] = "StockMaster - Password Reset OTP"
-        
-        # Email body
-        body = f"""
+POLL_SECONDS = 5  # Also picks up retries and messages queued by other workers
+LEASE_SECONDS = 120  # How long a claimed message is left to its worker
+IDLE_DISCONNECT_SECONDS = 30
+SMTP_TIMEOUT_SECONDS = 30
+RETRY_BASE_SECONDS = 10
+RETRY_MAX_SECONDS = 3600
+
+def smtp_configured() -> bool:
+    """A server, a sender address and, unless SMTP_AUTH is off, credentials"""
+    return bool(settings.SMTP_HOST and (settings.SMTP_FROM_EMAIL or settings.SMTP_USER)) and (
+        not settings.SMTP_AUTH or bool(settings.SMTP_USER and settings.SMTP_PASSWORD)
+    )
+
+def render_otp_email(otp_code: str) -> Tuple[str, str]:
+    """Subject and HTML body of the password reset email"""
+    subject = "StockMaster - Password Reset OTP"
+    body = f"""
         <html>
           <body style="font-family: Arial, sans-serif; padding: 20px;">
             <div style="max-width: 600px; margin: 0 auto; border: 4px solid #000; padding: 30px; box-shadow: 8px 8px 0px #000;">
@@ -41,19 +74,190 @@ def send_otp_email(email: str, otp_code: str) -> bool:
           </body>
         </html>
         """
-        
-        msg.attach(MIMEText(body, 'html'))
-        
-        # Send email
-        with smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT) as server:
-            server.starttls()
-            server.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
-            server.send_message(msg)
-        
-        logger.info(f"OTP email sent to {email}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Failed to send OTP email: {e}")
-        return False
+    return subject, body
+
+def queue_otp_email(session: AsyncSession, email: str, otp_code: str) -> None:
+    """Add the OTP email to the outbox; it is sent once the session commits"""
+    subject, body = render_otp_email(otp_code)
+    session.add(EmailOutbox(recipient=email, subject=subject, html_body=body))
+
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+def claim_due_messages(session: Session, limit: int) -> List[dict]:
+    """Lease up to `limit` due messages to this worker and count the attempt"""
+    now = datetime.utcnow()
+    due = (EmailOutbox.status == "pending") & (EmailOutbox.next_attempt_at <= now)
+    ids = session.exec(
+        select(EmailOutbox.id).where(due)
+        .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+        .limit(limit)
+    ).all()
+    if not ids:
+        return []
+    claimed = session.exec(
+        update(EmailOutbox)
+        .where(col(EmailOutbox.id).in_(ids) & due)
+        .values(next_attempt_at=now + timedelta(seconds=LEASE_SECONDS), attempts=EmailOutbox.attempts + 1)
+        .returning(EmailOutbox.id, EmailOutbox.recipient, EmailOutbox.subject, EmailOutbox.html_body, EmailOutbox.attempts)
+    ).all()
+    session.commit()
+    return [dict(row._mapping) for row in claimed]
+
+def record_results(session: Session, sent: List[int], failed: Dict[int, Tuple[int, str]], max_attempts: int) -> None:
+    """Mark sent messages, and schedule a retry (or give up) for failed ones"""
+    now = datetime.utcnow()
+    if sent:
+        session.exec(
+            update(EmailOutbox).where(col(EmailOutbox.id).in_(sent))
+            .values(status="sent", sent_at=now, last_error=None)
+        )
+    for message_id, (attempts, error) in failed.items():
+        values = {"last_error": error[:1000]}
+        if attempts >= max_attempts:
+            values["status"] = "failed"
+            logger.error(f"Giving up on email {message_id} after {attempts} attempts: {error}")
+        else:
+            values["next_attempt_at"] = now + retry_delay(attempts)
+        session.exec(update(EmailOutbox).where(EmailOutbox.id == message_id).values(**values))
+    session.commit()
+
+def build_message(message: dict) -> MIMEMultipart:
+    msg = MIMEMultipart()
+    msg['From'] = settings.SMTP_FROM_EMAIL or settings.SMTP_USER
+    msg['To'] = message["recipient"]
+    msg['Subject'] = message["subject"]
+    msg.attach(MIMEText(message["html_body"], 'html'))
+    return msg
+
+class MailQueue:
+    """Background delivery worker for the email outbox (one per process)"""
+
+    def __init__(self, engine, batch_size: int, max_attempts: int):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+        self._last_used = 0.0
+
+    async def start(self) -> None:
+        if not smtp_configured():
+            logger.warning("SMTP not configured - email outbox delivery disabled")
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._disconnect()
+        self._loop = None
+
+    def wake(self) -> None:
+        """Ask the worker to look for due messages now; safe to call from any thread"""
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                claimed = await self.deliver_due()
+            except Exception:
+                logger.exception("Email outbox delivery failed")
+                claimed = 0
+            if claimed == self.batch_size:
+                continue  # There may be more due messages
+            if self._smtp and time.monotonic() - self._last_used > IDLE_DISCONNECT_SECONDS:
+                await self._disconnect()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _claim(self) -> List[dict]:
+        with Session(self.engine) as session:
+            return claim_due_messages(session, self.batch_size)
+
+    def _record(self, sent: List[int], failed: Dict[int, Tuple[int, str]]) -> None:
+        with Session(self.engine) as session:
+            record_results(session, sent, failed, self.max_attempts)
+
+    async def deliver_due(self) -> int:
+        """Send one batch of due messages; returns how many were claimed"""
+        batch = await asyncio.to_thread(self._claim)
+        if not batch:
+            return 0
+        sent: List[int] = []
+        failed: Dict[int, Tuple[int, str]] = {}
+        try:
+            await self._connection()
+        except Exception as e:
+            # Server unreachable: fail the whole batch instead of retrying per message
+            logger.warning(f"SMTP connection failed: {e}")
+            await self._disconnect()
+            failed = {m["id"]: (m["attempts"], f"{type(e).__name__}: {e}") for m in batch}
+            batch = []
+        for message in batch:
+            try:
+                await self._send(build_message(message))
+                sent.append(message["id"])
+                logger.info(f"Email {message['id']} sent to {message['recipient']}")
+            except Exception as e:
+                failed[message["id"]] = (message["attempts"], f"{type(e).__name__}: {e}")
+                logger.warning(f"Email {message['id']} to {message['recipient']} failed (attempt {message['attempts']}): {e}")
+        await asyncio.to_thread(self._record, sent, failed)
+        return len(sent) + len(failed)
+
+    async def _connection(self) -> aiosmtplib.SMTP:
+        if self._smtp is None or not self._smtp.is_connected:
+            smtp = aiosmtplib.SMTP(
+                hostname=settings.SMTP_HOST,
+                port=settings.SMTP_PORT,
+                start_tls=settings.SMTP_STARTTLS,
+                timeout=SMTP_TIMEOUT_SECONDS
+            )
+            await smtp.connect()
+            try:
+                if settings.SMTP_AUTH:
+                    await smtp.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+            except Exception:
+                smtp.close()
+                raise
+            self._smtp = smtp
+        return self._smtp
+
+    async def _send(self, msg: MIMEMultipart) -> None:
+        try:
+            smtp = await self._connection()
+            await smtp.send_message(msg)
+            self._last_used = time.monotonic()
+        except aiosmtplib.SMTPServerDisconnected:
+            # The server closed the reused connection; reconnect once
+            await self._disconnect()
+            smtp = await self._connection()
+            await smtp.send_message(msg)
+            self._last_used = time.monotonic()
+        except Exception:
+            await self._disconnect()
+            raise
+
+    async def _disconnect(self) -> None:
+        smtp, self._smtp = self._smtp, None
+        if smtp is None or not smtp.is_connected:
+            return
+        try:
+            await smtp.quit()
+        except Exception:
+            smtp.close()
 
+mail_queue = MailQueue(engine, settings.OUTBOX_BATCH_SIZE, settings.OUTBOX_MAX_ATTEMPTS)
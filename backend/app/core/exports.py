@@ -0,0 +1,179 @@
+"""
+Streaming export helpers for the /reports endpoints.
+
+Rows are read through a server-side cursor (yield_per / stream_results) and
+written out in chunks as they arrive, so memory stays flat however many rows
+are exported. The generator opens its own connection on the request's
+database bind, because the response body is produced after the endpoint has
+returned.
+
+Parquet exports need the optional pyarrow package (pip install
+"backend[parquet]"). Cursor batches are collected into row groups of
+ROW_GROUP_SIZE rows, which bounds the writer's memory the same way while
+keeping row groups large enough to read efficiently.
+"""
+import csv
+import io
+import zlib
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.sql import Select
+from sqlmodel import Session
+
+from app.models.inventory import StockMove
+
+BATCH_SIZE = 5000
+ROW_GROUP_SIZE = 100_000
+
+def iter_batches(session: Session, stmt: Select, batch_size: int = BATCH_SIZE) -> Iterator[Sequence]:
+    """Yield lists of result rows from a server-side cursor, in a connection of their own"""
+    # Plain column rows don't need ORM loading, so execute at the Core level
+    with session.get_bind().connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(stmt)
+        for batch in result.partitions():
+            yield batch
+
+def csv_chunks(header: List[str], batches: Iterable[Sequence], format_row: Callable) -> Iterator[bytes]:
+    """Encode rows as CSV, one chunk per batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for batch in batches:
+        writer.writerows(format_row(row) for row in batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def csv_response(chunks: Iterable[bytes], filename: str, gzip: bool = False) -> StreamingResponse:
+    if gzip:
+        return StreamingResponse(
+            gzip_chunks(chunks),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f"attachment; filename={filename}.gz"}
+        )
+    return StreamingResponse(
+        chunks,
+        media_type="text/csv; charset=utf-8",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Content-Type": "text/csv; charset=utf-8"
+        }
+    )
+
+def filter_moves(
+    stmt: Select,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    move_type: Optional[str] = None,
+    status: Optional[str] = None,
+    warehouse_id: Optional[int] = None
+) -> Select:
+    """Apply the export filters to a StockMove query (date_to is inclusive)"""
+    if date_from:
+        stmt = stmt.where(StockMove.created_at >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        stmt = stmt.where(StockMove.created_at < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    if move_type:
+        stmt = stmt.where(StockMove.move_type == move_type)
+    if status:
+        stmt = stmt.where(StockMove.status == status)
+    if warehouse_id:
+        stmt = stmt.where(
+            (StockMove.source_warehouse_id == warehouse_id) |
+            (StockMove.dest_warehouse_id == warehouse_id)
+        )
+    return stmt
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands out what was written since the last drain"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Parquet export requires the pyarrow package")
+    return pyarrow
+
+def _arrow_type(pa, kind: str):
+    return {
+        "int": pa.int64(),
+        "string": pa.string(),
+        "category": pa.dictionary(pa.int32(), pa.string()),
+        "timestamp": pa.timestamp("us")
+    }[kind]
+
+def parquet_chunks(columns: List[tuple], batches: Iterable[Sequence], row_group_size: int = ROW_GROUP_SIZE) -> Iterator[bytes]:
+    """Encode rows as Parquet, one row group per row_group_size rows.
+
+    columns is a list of (name, kind) in row order, kind being one of "int",
+    "string", "category" or "timestamp". Category columns are dictionary
+    encoded in the file and load as pandas categoricals.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = [_arrow_type(pa, kind) for _, kind in columns]
+    schema = pa.schema([(name, type_) for (name, _), type_ in zip(columns, types)])
+    dictionary_columns = [name for name, kind in columns if kind == "category"]
+    sink = _ChunkSink()
+
+    def row_group(rows):
+        values = list(zip(*rows))
+        return pa.Table.from_arrays(
+            [pa.array(column, type=type_) for column, type_ in zip(values, types)],
+            schema=schema
+        )
+
+    with pq.ParquetWriter(sink, schema, compression="zstd", use_dictionary=dictionary_columns) as writer:
+        rows: List = []
+        for batch in batches:
+            rows.extend(batch)
+            if len(rows) >= row_group_size:
+                writer.write_table(row_group(rows), row_group_size=len(rows))
+                rows = []
+                yield sink.drain()
+        if rows:
+            writer.write_table(row_group(rows), row_group_size=len(rows))
+    yield sink.drain()
+
+def parquet_response(columns: List[tuple], batches: Iterable[Sequence], filename: str) -> StreamingResponse:
+    _require_pyarrow()
+    return StreamingResponse(
+        parquet_chunks(columns, batches),
+        media_type="application/vnd.apache.parquet",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
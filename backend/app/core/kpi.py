@@ -0,0 +1,178 @@
+"""
+Dashboard KPI snapshot cache.
+
+Each worker keeps a snapshot of the unfiltered dashboard figures: total
+products, low-stock products and move counts per (move_type, status). The
+write paths in operations.py and products.py adjust it in place after they
+commit, so it is not recomputed on every dashboard refresh. It is rebuilt
+from SQL only when it expires (KPI_CACHE_TTL_SECONDS) or another worker has
+written.
+
+Cross-worker invalidation: when KPI_GENERATION_FILE is set, every write
+stores a new random generation token in that file. Before answering, a worker
+compares the file with the token it last saw and rebuilds if they differ.
+Checking costs one small file read, with no database query. All workers must
+share the file, so this only covers workers on the same host. Without the
+setting, other workers are only refreshed by the TTL.
+
+Async endpoints use get_async(), which must not hold the thread lock while
+the query runs: other coroutines on the same event loop would block on it.
+
+Counting a write once: a rebuild can run between a write's commit and its
+hook (async handlers await in between), and would then already include the
+write. So write paths call begin_write() before committing, which bumps the
+version; a rebuild whose query started earlier is not stored, and the hook
+drops (rather than adjusts) a snapshot whose query started later, since it
+cannot tell whether that query saw the commit.
+"""
+import asyncio
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.models.inventory import StockMove
+from app.models.product import Product, low_stock_predicate
+
+MoveKey = Tuple[str, str]  # (move_type, status)
+
+class KpiCache:
+    def __init__(self, ttl_seconds: float, generation_file: Optional[str] = None):
+        self.ttl_seconds = ttl_seconds
+        self.generation_file = generation_file
+        self._lock = threading.Lock()
+        self._snapshot: Optional[dict] = None
+        self._loaded_at = 0.0
+        self._generation: Optional[str] = None
+        self._version = 0  # Bumped by begin_write() and every write hook
+        self._snapshot_version = 0  # _version when the stored snapshot's query started
+        self._rebuild_lock: Optional[asyncio.Lock] = None
+
+    def _read_generation(self) -> Optional[str]:
+        if not self.generation_file:
+            return None
+        try:
+            with open(self.generation_file) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _bump_generation(self) -> None:
+        if not self.generation_file:
+            return
+        generation = uuid.uuid4().hex
+        tmp_path = f"{self.generation_file}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(generation)
+        os.replace(tmp_path, self.generation_file)
+        self._generation = generation
+
+    def _compute(self, session: Session) -> dict:
+        total_products, low_stock = session.exec(
+            select(func.count(), func.count().filter(low_stock_predicate())).select_from(Product)
+        ).one()
+        moves = session.exec(
+            select(StockMove.move_type, StockMove.status, func.count())
+            .group_by(StockMove.move_type, StockMove.status)
+        ).all()
+        return {
+            "total_products": total_products,
+            "low_stock": low_stock,
+            "moves": {(move_type, status): count for move_type, status, count in moves}
+        }
+
+    def get(self, session: Session) -> dict:
+        """Current snapshot, rebuilt from SQL if expired or invalidated by another worker"""
+        generation = self._read_generation()
+        with self._lock:
+            expired = time.monotonic() - self._loaded_at > self.ttl_seconds
+            if self._snapshot is None or expired or generation != self._generation:
+                self._snapshot = self._compute(session)
+                self._snapshot_version = self._version
+                self._loaded_at = time.monotonic()
+                self._generation = generation
+            return {**self._snapshot, "moves": dict(self._snapshot["moves"])}
+
+    def _current(self, generation: Optional[str]) -> Optional[dict]:
+        with self._lock:
+            expired = time.monotonic() - self._loaded_at > self.ttl_seconds
+            if self._snapshot is None or expired or generation != self._generation:
+                return None
+            return {**self._snapshot, "moves": dict(self._snapshot["moves"])}
+
+    async def get_async(self, session: AsyncSession) -> dict:
+        """get() for async endpoints; concurrent rebuilds in one worker share a single query"""
+        generation = self._read_generation()
+        snapshot = self._current(generation)
+        if snapshot is not None:
+            return snapshot
+        if self._rebuild_lock is None:
+            self._rebuild_lock = asyncio.Lock()
+        async with self._rebuild_lock:
+            snapshot = self._current(generation)
+            if snapshot is not None:
+                return snapshot
+            with self._lock:
+                version = self._version
+            snapshot = await session.run_sync(self._compute)
+            with self._lock:
+                # A write that landed while the query ran may be missing from it
+                if version == self._version:
+                    self._snapshot = snapshot
+                    self._snapshot_version = version
+                    self._loaded_at = time.monotonic()
+                    self._generation = generation
+            return {**snapshot, "moves": dict(snapshot["moves"])}
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._snapshot = None
+            self._version += 1
+            self._bump_generation()
+
+    def begin_write(self) -> int:
+        """Call before committing a write; pass the result to its hook"""
+        with self._lock:
+            self._version += 1
+            return self._version
+
+    def _apply(self, write: int, products: int = 0, low_stock: int = 0, moves: Optional[Dict[MoveKey, int]] = None) -> None:
+        with self._lock:
+            if self._snapshot is not None and self._snapshot_version >= write:
+                # Its query may or may not have seen the commit
+                self._snapshot = None
+            elif self._snapshot is not None:
+                self._snapshot["total_products"] += products
+                self._snapshot["low_stock"] += low_stock
+                counts = self._snapshot["moves"]
+                for key, delta in (moves or {}).items():
+                    counts[key] = counts.get(key, 0) + delta
+            self._version += 1
+            self._bump_generation()
+
+    # Write-path hooks, called after the change is committed with the
+    # begin_write() token taken before it
+
+    def moves_created(self, write: int, counts: Dict[str, int]) -> None:
+        """New draft moves, as {move_type: count}"""
+        self._apply(write, moves={(move_type, "draft"): count for move_type, count in counts.items()})
+
+    def moves_status_changed(self, write: int, changes: Dict[Tuple[str, str, str], int]) -> None:
+        """Status changes, as {(move_type, old_status, new_status): count}"""
+        deltas: Dict[MoveKey, int] = {}
+        for (move_type, old_status, new_status), count in changes.items():
+            deltas[(move_type, old_status)] = deltas.get((move_type, old_status), 0) - count
+            deltas[(move_type, new_status)] = deltas.get((move_type, new_status), 0) + count
+        self._apply(write, moves=deltas)
+
+    def products_changed(self, write: int, added: int = 0, low_stock: int = 0) -> None:
+        """Products added (negative when deleted) and the net change in low-stock products"""
+        self._apply(write, products=added, low_stock=low_stock)
+
+kpi_cache = KpiCache(settings.KPI_CACHE_TTL_SECONDS, settings.KPI_GENERATION_FILE or None)
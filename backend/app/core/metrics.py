@@ -0,0 +1,113 @@
+"""
+Prometheus metrics, served at GET /metrics.
+
+Each worker updates its own metric values; nothing is shared or locked
+between requests beyond the per-value lock prometheus_client uses. To run
+several uvicorn workers, point PROMETHEUS_MULTIPROC_DIR at an empty
+directory, the same for all workers and cleared on deploy. Every worker
+then writes its values to memory-mapped files there, and a scrape of any
+worker sums them up. Gauges report the sum over live workers.
+
+Route labels use the route template ("/products/{product_id}"), so label
+cardinality stays bounded; requests that match no route are labelled
+"unmatched".
+"""
+import os
+import time
+
+import anyio.to_thread
+from fastapi import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+)
+
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests handled", ["method", "route", "status"]
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time from request start to the end of the response body",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests being handled", ["method"], multiprocess_mode="livesum"
+)
+THREADPOOL_BUSY = Gauge(
+    "threadpool_busy_threads", "Threads of the sync endpoint threadpool in use", multiprocess_mode="livesum"
+)
+THREADPOOL_SIZE = Gauge(
+    "threadpool_max_threads", "Size of the sync endpoint threadpool", multiprocess_mode="livesum"
+)
+DB_POOL_SIZE = Gauge(
+    "db_pool_size", "Configured connections kept open", ["engine"], multiprocess_mode="livesum"
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Connections currently in use", ["engine"], multiprocess_mode="livesum"
+)
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow", "Connections open beyond the pool size, as of the last checkout", ["engine"], multiprocess_mode="livesum"
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time to get a connection from the pool", ["engine"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+MOVES_VALIDATED = Counter(
+    "stock_moves_validated_total", "Stock moves validated (set to done)", ["move_type"]
+)
+REFERENCE_ALLOCATION = Histogram(
+    "reference_allocation_seconds", "Time to reserve stock move references", ["mode"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+)
+
+class PrometheusMiddleware:
+    """Request counts, latency and in-flight requests per route (pure ASGI, no buffering)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method = scope["method"]
+        status = 500  # Unless a response starts
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        sample_threadpool()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_progress.dec()
+            sample_threadpool()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_DURATION.labels(method, route).observe(time.perf_counter() - started)
+            REQUESTS.labels(method, route, str(status)).inc()
+
+def sample_threadpool() -> None:
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    THREADPOOL_BUSY.set(limiter.borrowed_tokens)
+    THREADPOOL_SIZE.set(limiter.total_tokens)
+
+def metrics_response() -> Response:
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+def worker_stopped() -> None:
+    """Drop this worker's live gauges from the multiprocess files"""
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(os.getpid())
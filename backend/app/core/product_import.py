@@ -0,0 +1,297 @@
+"""
+Bulk product import for POST /products/import.
+
+The uploaded CSV (with a header row) or JSONL file is read row by row and
+each row is checked in Python. Valid rows are loaded into a temporary
+staging table in batches of STAGE_BATCH_SIZE: with COPY on PostgreSQL
+(psycopg2), with an executemany INSERT elsewhere (SQLite). Everything after
+that is set-based SQL over the staging table, a fixed number of statements
+whatever the file size:
+
+- missing categories are created with one INSERT ... ON CONFLICT DO NOTHING,
+  and every row's category is resolved with one UPDATE;
+- products are upserted on sku with one INSERT ... SELECT ... ON CONFLICT;
+- the new products' initial stock is seeded into ProductStock with one
+  INSERT ... SELECT.
+
+Starlette spools large uploads to disk. Only one batch of rows and the
+first MAX_REPORTED_ERRORS errors are held in memory, so memory stays flat
+however large the file is. The import runs in the request's transaction and
+is applied completely or not at all.
+
+Row semantics:
+- A SKU may appear on several rows, e.g. one per warehouse. Its product
+  fields come from its last row. Its initial stock is the sum over its rows,
+  seeded per warehouse_id; the endpoint's warehouse_id is the default.
+  Rows without a warehouse only count toward current_stock, as with
+  POST /products/.
+- For an existing SKU, name and uom are updated. Category and
+  min_stock_level are updated only when the row has one. Its stock is left
+  alone, since stock changes go through moves. Rows with initial stock for
+  an existing SKU are counted in stock_skipped.
+"""
+import csv
+import io
+import json
+from typing import BinaryIO, Iterator, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import (
+    Boolean, Column, Index, Integer, MetaData, String, Table, and_, case, distinct, false, func, insert, select, update
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, col
+
+from app.models.category import Category
+from app.models.inventory import ProductStock, Warehouse
+from app.models.product import Product, low_stock_predicate
+from app.schemas.product import ProductImportError, ProductImportResult
+
+STAGE_BATCH_SIZE = 10_000
+MAX_REPORTED_ERRORS = 100
+FORMATS = ("csv", "jsonl")
+REQUIRED_FIELDS = ("sku", "name", "uom")
+
+STAGE_COLUMNS = (
+    "line", "sku", "name", "category_name", "category_id", "uom", "min_stock_level", "initial_stock", "warehouse_id"
+)
+
+stage = Table(
+    "product_import_stage", MetaData(),
+    Column("line", Integer, nullable=False),
+    Column("sku", String, nullable=False),
+    Column("name", String, nullable=False),
+    Column("category_name", String),
+    Column("category_id", Integer),
+    Column("uom", String, nullable=False),
+    Column("min_stock_level", Integer),
+    Column("initial_stock", Integer, nullable=False),
+    Column("warehouse_id", Integer),
+    Column("existing", Boolean, nullable=False, server_default=false()),  # SKU already in product
+    Index("ix_product_import_stage_sku_line", "sku", "line"),
+    prefixes=["TEMPORARY"]
+)
+
+def file_format_for(filename: Optional[str]) -> str:
+    return "jsonl" if (filename or "").lower().endswith((".jsonl", ".ndjson")) else "csv"
+
+def _records(upload: BinaryIO, file_format: str) -> Iterator[Tuple[int, Optional[dict]]]:
+    """(line, fields) for each data row; fields is None for an unreadable JSONL line"""
+    text = io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+    try:
+        if file_format == "csv":
+            reader = csv.DictReader(text)
+            missing = [field for field in REQUIRED_FIELDS if field not in (reader.fieldnames or [])]
+            if missing:
+                raise HTTPException(status_code=400, detail=f"Missing columns: {', '.join(missing)}")
+            for record in reader:
+                yield reader.line_num, record
+        else:
+            for line, content in enumerate(text, start=1):
+                if not content.strip():
+                    continue
+                try:
+                    record = json.loads(content)
+                except ValueError:
+                    record = None
+                yield line, record if isinstance(record, dict) else None
+    finally:
+        # Leave the upload open for Starlette to close
+        text.detach()
+
+def _text(record: dict, field: str) -> Optional[str]:
+    value = record.get(field)
+    if value is None:
+        return None
+    return str(value).strip() or None
+
+def _integer(record: dict, field: str) -> Optional[int]:
+    value = record.get(field)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"{field} must be an integer")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be an integer")
+
+def parse_row(record: Optional[dict], warehouse_ids: Set[int], category_ids: Set[int], default_warehouse_id: Optional[int]) -> dict:
+    """Staging row for one record; raises ValueError with the reason it is invalid"""
+    if record is None:
+        raise ValueError("Not a JSON object")
+    row = {field: _text(record, field) for field in REQUIRED_FIELDS}
+    missing = [field for field in REQUIRED_FIELDS if row[field] is None]
+    if missing:
+        raise ValueError(f"Missing {', '.join(missing)}")
+    row["category_name"] = _text(record, "category")
+    row["category_id"] = _integer(record, "category_id")
+    row["min_stock_level"] = _integer(record, "min_stock_level")
+    row["initial_stock"] = _integer(record, "initial_stock") or 0
+    warehouse_id = _integer(record, "warehouse_id")
+    row["warehouse_id"] = warehouse_id if warehouse_id is not None else default_warehouse_id
+    if row["initial_stock"] < 0:
+        raise ValueError("initial_stock must not be negative")
+    if row["category_id"] is not None and row["category_id"] not in category_ids:
+        raise ValueError(f"Category {row['category_id']} not found")
+    if row["warehouse_id"] is not None and row["warehouse_id"] not in warehouse_ids:
+        raise ValueError(f"Warehouse {row['warehouse_id']} not found")
+    return row
+
+def _load(session: Session, rows: List[dict]) -> None:
+    """Append rows to the staging table"""
+    connection = session.connection()
+    if connection.dialect.name == "postgresql" and connection.dialect.driver == "psycopg2":
+        buffer = io.StringIO()
+        # None is written as an unquoted empty field, which COPY reads as NULL
+        csv.writer(buffer).writerows([row[column] for column in STAGE_COLUMNS] for row in rows)
+        buffer.seek(0)
+        with connection.connection.dbapi_connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {stage.name} ({', '.join(STAGE_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer
+            )
+    else:
+        connection.execute(insert(stage), rows)
+
+def _low_stock_count(session: Session) -> int:
+    """Low-stock products among the staged SKUs"""
+    return session.connection().execute(
+        select(func.count()).select_from(Product)
+        .where(col(Product.sku).in_(select(stage.c.sku)), low_stock_predicate())
+    ).scalar_one()
+
+def run_import(
+    session: Session,
+    upload: BinaryIO,
+    file_format: str,
+    default_warehouse_id: Optional[int] = None,
+    all_or_nothing: bool = True
+) -> Tuple[ProductImportResult, int]:
+    """
+    Stage and apply an import file in the session's transaction, without
+    committing. Returns the report and the net change in low-stock products.
+    """
+    warehouse_ids = set(session.scalars(select(Warehouse.id)).all())
+    if default_warehouse_id is not None and default_warehouse_id not in warehouse_ids:
+        raise HTTPException(status_code=404, detail="Warehouse not found")
+    category_ids = set(session.scalars(select(Category.id)).all())
+
+    connection = session.connection()
+    # SQLite may keep the table on a pooled connection after a failed import
+    stage.drop(connection, checkfirst=True)
+    stage.create(connection)
+
+    rows = 0
+    errors: List[ProductImportError] = []
+    error_count = 0
+    batch: List[dict] = []
+    try:
+        for line, record in _records(upload, file_format):
+            rows += 1
+            try:
+                row = parse_row(record, warehouse_ids, category_ids, default_warehouse_id)
+            except ValueError as e:
+                error_count += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append(ProductImportError(line=line, detail=str(e)))
+                continue
+            row["line"] = line
+            batch.append(row)
+            if len(batch) >= STAGE_BATCH_SIZE:
+                _load(session, batch)
+                batch = []
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Unreadable {file_format.upper()} file: {e}")
+    if errors and all_or_nothing:
+        raise HTTPException(status_code=400, detail=[e.model_dump() for e in errors])
+    if batch:
+        _load(session, batch)
+
+    dialect_insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    category = Category.__table__
+    product = Product.__table__
+
+    # Categories by name: create the missing ones, then resolve every row's id and name
+    names = (
+        select(stage.c.category_name)
+        .where(stage.c.category_id.is_(None), stage.c.category_name.is_not(None))
+        .distinct()
+    )
+    categories_created = connection.execute(
+        dialect_insert(category).from_select(["name"], names).on_conflict_do_nothing(index_elements=["name"])
+    ).rowcount
+    connection.execute(
+        update(stage)
+        .where(stage.c.category_id.is_(None), stage.c.category_name.is_not(None))
+        .values(category_id=select(category.c.id).where(category.c.name == stage.c.category_name).scalar_subquery())
+    )
+    connection.execute(
+        update(stage)
+        .where(stage.c.category_id.is_not(None))
+        .values(category_name=select(category.c.name).where(category.c.id == stage.c.category_id).scalar_subquery())
+    )
+
+    connection.execute(update(stage).where(stage.c.sku.in_(select(product.c.sku))).values(existing=True))
+    skus, existing_skus, stock_skipped = connection.execute(select(
+        func.count(distinct(stage.c.sku)),
+        func.count(distinct(stage.c.sku)).filter(stage.c.existing),
+        func.count().filter(and_(stage.c.existing, stage.c.initial_stock != 0))
+    )).one()
+    low_stock_before = _low_stock_count(session)
+
+    # The last row of each SKU, with the SKU's total initial stock
+    last = (
+        select(stage.c.sku, func.max(stage.c.line).label("line"), func.sum(stage.c.initial_stock).label("stock"))
+        .group_by(stage.c.sku)
+        .subquery()
+    )
+    source = (
+        select(
+            stage.c.sku, stage.c.name, stage.c.category_id, func.coalesce(stage.c.category_name, ""),
+            stage.c.uom, stage.c.min_stock_level, last.c.stock
+        )
+        .select_from(stage.join(last, and_(stage.c.sku == last.c.sku, stage.c.line == last.c.line)))
+        # SQLite needs a WHERE before ON CONFLICT to parse an upsert from a join
+        .where(stage.c.sku.is_not(None))
+        # Lock product rows in SKU order, so concurrent imports can't deadlock
+        .order_by(stage.c.sku)
+    )
+    upsert = dialect_insert(product).from_select(
+        ["sku", "name", "category_id", "category", "uom", "min_stock_level", "current_stock"], source
+    )
+    connection.execute(upsert.on_conflict_do_update(
+        index_elements=["sku"],
+        set_={
+            "name": upsert.excluded.name,
+            "uom": upsert.excluded.uom,
+            "category_id": func.coalesce(upsert.excluded.category_id, product.c.category_id),
+            "category": case((upsert.excluded.category_id.is_(None), product.c.category), else_=upsert.excluded.category),
+            "min_stock_level": func.coalesce(upsert.excluded.min_stock_level, product.c.min_stock_level)
+        }
+    ))
+
+    stock_source = (
+        select(product.c.id, stage.c.warehouse_id, func.sum(stage.c.initial_stock))
+        .select_from(stage.join(product, product.c.sku == stage.c.sku))
+        .where(~stage.c.existing, stage.c.warehouse_id.is_not(None), stage.c.initial_stock != 0)
+        .group_by(product.c.id, stage.c.warehouse_id)
+        .order_by(product.c.id, stage.c.warehouse_id)
+    )
+    stock_rows = connection.execute(
+        insert(ProductStock.__table__).from_select(["product_id", "warehouse_id", "quantity"], stock_source)
+    ).rowcount
+
+    low_stock_change = _low_stock_count(session) - low_stock_before
+    stage.drop(connection)
+
+    result = ProductImportResult(
+        rows=rows,
+        created=skus - existing_skus,
+        updated=existing_skus,
+        categories_created=categories_created,
+        stock_rows=stock_rows,
+        stock_skipped=stock_skipped,
+        error_count=error_count,
+        errors=errors
+    )
+    return result, low_stock_change
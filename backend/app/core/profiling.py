@@ -0,0 +1,269 @@
+"""
+Opt-in sampling profiler for single requests.
+
+A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>`, or at
+random with probability PROFILE_SAMPLE_RATE. The response then has an
+X-Profile-Id header, and the profile is saved as speedscope JSON
+(https://www.speedscope.app) in PROFILE_DIR, where the /system/profiles
+endpoints list and serve it. Only the newest PROFILE_KEEP files are kept.
+
+While any profiled request is in flight, a sampler thread reads the stack
+of every thread each PROFILE_INTERVAL_MS. A profile hook on all threads
+records which request each thread is working for: the event loop thread
+while it runs the request's task, and threadpool threads while they run its
+sync endpoint or dependencies (anyio copies the request's context into the
+thread). Samples are kept only for the threads working for the profiled
+request, so concurrent requests don't leak into its profile. When no thread
+is working for it, the request's task is waiting (usually on the async
+database driver); the sample is then its chain of suspended coroutines
+under a "(waiting)" frame, so I/O waits show up with the code that awaited
+them. The hook costs a little on every Python call in the worker, but only
+while a profile is being taken.
+
+With no PROFILE_TOKEN and a zero sample rate the middleware is not
+installed at all.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import anyio.to_thread
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+PROFILE_SUFFIX = ".speedscope.json"
+
+FrameKey = Tuple[str, str, int]  # (function, file, first line)
+WAITING: FrameKey = ("(waiting)", "", 0)
+
+class RequestProfile:
+    """Stack samples collected for one request"""
+
+    def __init__(self, profile_id: str, method: str, path: str):
+        self.id = profile_id
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.task = asyncio.current_task()
+        self.samples: List[Tuple[FrameKey, ...]] = []
+        self.weights: List[float] = []
+
+    def add_sample(self, stack: Tuple[FrameKey, ...], seconds: float) -> None:
+        self.samples.append(stack)
+        self.weights.append(seconds)
+
+    def to_speedscope(self, route: str, status: int) -> dict:
+        frame_index: Dict[FrameKey, int] = {}
+        frames = []
+        samples = []
+        for stack in self.samples:
+            indexes = []
+            for key in stack:
+                if key not in frame_index:
+                    frame_index[key] = len(frames)
+                    frames.append({"name": key[0], "file": key[1], "line": key[2]})
+                indexes.append(frame_index[key])
+            samples.append(indexes)
+        duration = time.perf_counter() - self.started
+        name = f"{route} ({status}, {duration * 1000:.0f} ms)"
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "stockmaster",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(self.weights),
+                "samples": samples,
+                "weights": self.weights
+            }]
+        }
+
+_current: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+
+def _stack(frame) -> Tuple[FrameKey, ...]:
+    """Root-first stack of a frame"""
+    keys = []
+    while frame is not None:
+        code = frame.f_code
+        keys.append((code.co_qualname, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    keys.reverse()
+    return tuple(keys)
+
+def _await_stack(task: Optional[asyncio.Task]) -> Tuple[FrameKey, ...]:
+    """Root-first chain of the coroutines a suspended task is waiting in"""
+    keys = []
+    awaitable = task.get_coro() if task is not None else None
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            break
+        code = frame.f_code
+        keys.append((code.co_qualname, code.co_filename, code.co_firstlineno))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    keys.append(WAITING)
+    return tuple(keys)
+
+class Sampler:
+    """Samples the threads working for profiled requests; runs only while one is active"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._owners: Dict[int, Optional[RequestProfile]] = {}  # thread id -> request it works for
+        self._profiles: List[RequestProfile] = []
+        self._thread: Optional[threading.Thread] = None
+        # Each sampler thread gets its own stop event: a begin() right after an end() must not
+        # clear the event the previous thread is still waiting on
+        self._stop: Optional[threading.Event] = None
+
+    def _hook(self, frame, event, arg):
+        # Runs on every call in every thread while sampling; keep it small
+        if event == "call":
+            profile = _current.get()
+            ident = threading.get_ident()
+            if self._owners.get(ident) is not profile:
+                self._owners[ident] = profile
+
+    def _run(self, interval: float, stop: threading.Event) -> None:
+        own = threading.get_ident()
+        previous = time.perf_counter()
+        while not stop.wait(interval):
+            now = time.perf_counter()
+            # Each sample stands for the time since the previous one
+            elapsed, previous = now - previous, now
+            sampled = set()
+            for ident, frame in sys._current_frames().items():
+                profile = self._owners.get(ident)
+                if profile is not None and ident != own:
+                    profile.add_sample(_stack(frame), elapsed)
+                    sampled.add(profile)
+            for profile in list(self._profiles):
+                if profile not in sampled:
+                    profile.add_sample(_await_stack(profile.task), elapsed)
+
+    def begin(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.append(profile)
+            if len(self._profiles) > 1:
+                return
+            self._stop = threading.Event()
+            threading.setprofile_all_threads(self._hook)
+            self._thread = threading.Thread(
+                target=self._run, args=(settings.PROFILE_INTERVAL_MS / 1000, self._stop), name="request-profiler",
+                daemon=True
+            )
+            self._thread.start()
+
+    def end(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.remove(profile)
+            if self._profiles:
+                return
+            threading.setprofile_all_threads(None)
+            self._stop.set()
+            thread, self._thread, self._stop = self._thread, None, None
+            self._owners.clear()
+        thread.join()
+
+sampler = Sampler()
+
+def profile_dir() -> Path:
+    return Path(settings.PROFILE_DIR)
+
+def _should_profile(scope) -> bool:
+    token = Headers(scope=scope).get(PROFILE_HEADER)
+    if token and settings.PROFILE_TOKEN and secrets.compare_digest(token, settings.PROFILE_TOKEN):
+        return True
+    return settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE
+
+def _save(profile: RequestProfile, route: str, status: int) -> None:
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{profile.id}{PROFILE_SUFFIX}"
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(profile.to_speedscope(route, status), f)
+    os.replace(tmp_path, path)
+    # Keep the newest PROFILE_KEEP profiles
+    saved = sorted(directory.glob(f"*{PROFILE_SUFFIX}"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in saved[settings.PROFILE_KEEP:]:
+        old.unlink(missing_ok=True)
+
+def profiling_enabled() -> bool:
+    return bool(settings.PROFILE_TOKEN) or settings.PROFILE_SAMPLE_RATE > 0
+
+class ProfilerMiddleware:
+    """Profiles selected requests (pure ASGI, no buffering)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _should_profile(scope):
+            return await self.app(scope, receive, send)
+        profile_id = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        profile = RequestProfile(profile_id, scope["method"], scope["path"])
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append(PROFILE_ID_HEADER, profile_id)
+            await send(message)
+
+        token = _current.set(profile)
+        sampler.begin(profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _current.reset(token)
+            # Joining the sampler thread and writing the file block; keep them off the event loop
+            await anyio.to_thread.run_sync(sampler.end, profile)
+            route = f"{scope['method']} {getattr(scope.get('route'), 'path', scope['path'])}"
+            try:
+                await anyio.to_thread.run_sync(_save, profile, route, status)
+                logger.info(f"Saved profile {profile_id} for {route} ({len(profile.samples)} samples)")
+            except OSError as e:
+                logger.error(f"Could not save profile {profile_id}: {e}")
+
+def list_profiles() -> List[dict]:
+    directory = profile_dir()
+    if not directory.is_dir():
+        return []
+    profiles = []
+    for path in sorted(directory.glob(f"*{PROFILE_SUFFIX}"), key=lambda p: p.stat().st_mtime, reverse=True):
+        stat = path.stat()
+        profiles.append({
+            "id": path.name[:-len(PROFILE_SUFFIX)],
+            "created_at": datetime.utcfromtimestamp(stat.st_mtime),
+            "size": stat.st_size
+        })
+    return profiles
+
+def profile_path(profile_id: str) -> Optional[Path]:
+    """Path of a saved profile, or None (ids are checked, so they can't escape PROFILE_DIR)"""
+    if not profile_id or any(c not in "0123456789abcdefT-" for c in profile_id):
+        return None
+    path = profile_dir() / f"{profile_id}{PROFILE_SUFFIX}"
+    return path if path.is_file() else None
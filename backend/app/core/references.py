@@ -1,67 +1,204 @@
 """
 Utility functions for generating auto-incrementing references.
 Format: AW/YYYY/0001 (e.g., AW/2023/0001)
+
+Serials come from the ReferenceSequence counter table (one row per prefix and
+year). The counter is incremented with a single atomic UPDATE, so allocating a
+reference costs the same no matter how many moves exist, and concurrent
+requests can never receive the same serial.
 """
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.core.metrics import REFERENCE_ALLOCATION
 from app.models.inventory import StockMove
-from datetime import datetime
-from typing import Optional
+from app.models.sequence import ReferenceSequence
+
+MAX_SERIAL = 9999
+
+# Prefix per move type (IN and OUT share the AW series)
+PREFIX_MAP = {
+    "IN": "AW",   # Receipts
+    "OUT": "AW",  # Deliveries (can be customized)
+    "INT": "INT", # Internal Transfers
+    "ADJ": "ADJ"  # Adjustments
+}
+
+def get_prefix(move_type: str) -> str:
+    return PREFIX_MAP.get(move_type, "AW")
+
+def format_reference(prefix: str, year: int, serial: int) -> str:
+    return f"{prefix}/{year}/{str(serial).zfill(4)}"
+
+def parse_reference(reference: str) -> Optional[Tuple[str, int, int]]:
+    """Parse AW/2023/0001 -> ("AW", 2023, 1). Returns None for malformed references."""
+    try:
+        parts = reference.split('/')
+        if len(parts) == 3:
+            return parts[0], int(parts[1]), int(parts[2])
+    except (ValueError, AttributeError):
+        pass
+    return None
+
+def _existing_max_serial(session: Session, prefix: str, year: int) -> int:
+    """Highest serial already used for prefix/year.
+
+    Only runs once per prefix and year, when the counter row is first created,
+    so databases that predate the counter table continue their existing series.
+    Serials are zero-padded to 4 digits, so the greatest string is the greatest serial.
+    """
+    highest = session.exec(
+        select(func.max(StockMove.reference)).where(
+            StockMove.reference.like(f"{prefix}/{year}/____")
+        )
+    ).one()
+    parsed = parse_reference(highest) if highest else None
+    return parsed[2] if parsed else 0
+
+def allocate_serials(session: Session, prefix: str, year: int, count: int = 1) -> int:
+    """
+    Atomically reserve `count` consecutive serials for prefix/year and return the first.
+
+    The counter row stays locked until the caller's transaction ends, so a
+    rolled-back request gives its serials back. Raises ValueError when the
+    block would go past MAX_SERIAL; the caller must roll back in that case.
+    """
+    last_value = session.execute(
+        update(ReferenceSequence)
+        .where(
+            (ReferenceSequence.prefix == prefix) &
+            (ReferenceSequence.year == year)
+        )
+        .values(last_value=ReferenceSequence.last_value + count)
+        .returning(ReferenceSequence.last_value)
+    ).scalar_one_or_none()
+
+    if last_value is None:
+        # First allocation for this prefix/year. ON CONFLICT covers two workers
+        # racing to create the row: the loser increments the winner's row.
+        seed = _existing_max_serial(session, prefix, year)
+        dialect = session.get_bind().dialect.name
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(ReferenceSequence).values(prefix=prefix, year=year, last_value=seed + count)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["prefix", "year"],
+            set_={"last_value": ReferenceSequence.last_value + count}
+        ).returning(ReferenceSequence.last_value)
+        last_value = session.execute(stmt).scalar_one()
+
+    if last_value > MAX_SERIAL:
+        raise ValueError(f"Serial number exceeded maximum ({MAX_SERIAL}) for {prefix} in year {year}")
+
+    return last_value - count + 1
+
+class ReferenceBlockAllocator:
+    """
+    Hands out serials from blocks pre-allocated per worker process.
+
+    Each block is reserved in its own short transaction, so requests don't hold
+    the counter row lock. Serials left in a block when the worker exits, or
+    when two requests of one worker reserve a block at the same time, are
+    never used, which leaves gaps in the series.
+    """
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self._blocks: Dict[Tuple[str, int], List[int]] = {}  # (prefix, year) -> [next, last]
+        self._lock = threading.Lock()
+
+    def _reserve_block(self, session: Session, prefix: str, year: int, size: int) -> int:
+        with Session(session.get_bind()) as block_session:
+            first = allocate_serials(block_session, prefix, year, size)
+            block_session.commit()
+            return first
+
+    def take(self, session: Session, prefix: str, year: int, count: int = 1) -> int:
+        with self._lock:
+            block = self._blocks.get((prefix, year))
+            if block is not None and block[1] - block[0] + 1 >= count:
+                first = block[0]
+                block[0] += count
+                return first
+        # Reserve outside the lock: under run_sync (async endpoints) the query
+        # yields to the event loop, and other requests must not block on it
+        size = max(self.block_size, count)
+        try:
+            first = self._reserve_block(session, prefix, year, size)
+        except ValueError:
+            if size == count:
+                raise
+            # Near the end of the year's series, fall back to an exact-size block
+            size = count
+            first = self._reserve_block(session, prefix, year, size)
+        with self._lock:
+            # Another request may have reserved a block meanwhile; keep the larger remainder
+            rest = [first + count, first + size - 1]
+            block = self._blocks.get((prefix, year))
+            if block is None or block[1] - block[0] < rest[1] - rest[0]:
+                self._blocks[(prefix, year)] = rest
+        return first
+
+_block_allocator = (
+    ReferenceBlockAllocator(settings.REFERENCE_BLOCK_SIZE)
+    if settings.REFERENCE_BLOCK_SIZE > 1 else None
+)
+
+def reserve_references(move_type: str, session: Session, count: int = 1) -> List[str]:
+    """Reserve `count` consecutive references for move_type in one counter update"""
+    prefix = get_prefix(move_type)
+    current_year = datetime.now().year
+
+    started = time.perf_counter()
+    if _block_allocator:
+        first = _block_allocator.take(session, prefix, current_year, count)
+    else:
+        first = allocate_serials(session, prefix, current_year, count)
+    REFERENCE_ALLOCATION.labels("block" if _block_allocator else "inline").observe(time.perf_counter() - started)
+
+    return [format_reference(prefix, current_year, first + i) for i in range(count)]
 
 def generate_reference(move_type: str, session: Session) -> str:
     """
     Generate a reference number in format: AW/YYYY/0001
-    
+
     Rules:
     - AW prefix (can be customized per move type)
     - YYYY is current year
     - 0001-9999 serial number (max 4 digits)
     - Resets per year
     """
-    current_year = datetime.now().year
-    
-    # Determine prefix based on move type
-    prefix_map = {
-        "IN": "AW",   # Receipts
-        "OUT": "AW",  # Deliveries (can be customized)
-        "INT": "INT", # Internal Transfers
-        "ADJ": "ADJ"  # Adjustments
-    }
-    prefix = prefix_map.get(move_type, "AW")
-    
-    # Get all moves of this type with references
-    all_moves = session.exec(
-        select(StockMove).where(
-            (StockMove.move_type == move_type) &
-            (StockMove.reference.isnot(None))
-        )
-    ).all()
-    
-    # Extract serial numbers from existing references for current year
-    max_serial = 0
-    for move in all_moves:
-        if move.reference:
-            try:
-                # Parse reference: AW/2023/0001 -> extract year and serial
-                parts = move.reference.split('/')
-                if len(parts) == 3:
-                    ref_year = int(parts[1])
-                    if ref_year == current_year:
-                        serial = int(parts[2])
-                        max_serial = max(max_serial, serial)
-            except (ValueError, IndexError):
-                continue
-    
-    # Increment serial number
-    next_serial = max_serial + 1
-    
-    # Format with leading zeros (4 digits max)
-    if next_serial > 9999:
-        raise ValueError(f"Serial number exceeded maximum (9999) for {move_type} in year {current_year}")
-    
-    serial_str = str(next_serial).zfill(4)
-    
-    # Generate reference: AW/YYYY/0001
-    reference = f"{prefix}/{current_year}/{serial_str}"
-    
-    return reference
+    return reserve_references(move_type, session)[0]
+
+def backfill_reference_sequences(session: Session) -> Dict[Tuple[str, int], int]:
+    """
+    Rebuild counters from existing move references (one-time, for databases
+    created before the counter table). Counters are only ever moved forward.
+    """
+    highest: Dict[Tuple[str, int], int] = {}
+    references = session.exec(
+        select(StockMove.reference)
+        .where(StockMove.reference.isnot(None))
+        .execution_options(yield_per=5000)
+    )
+    for reference in references:
+        parsed = parse_reference(reference)
+        if parsed:
+            prefix, year, serial = parsed
+            highest[(prefix, year)] = max(highest.get((prefix, year), 0), serial)
 
+    for (prefix, year), serial in highest.items():
+        sequence = session.get(ReferenceSequence, (prefix, year))
+        if sequence is None:
+            session.add(ReferenceSequence(prefix=prefix, year=year, last_value=serial))
+        elif sequence.last_value < serial:
+            sequence.last_value = serial
+            session.add(sequence)
+    session.commit()
+    return highest
@@ -0,0 +1,124 @@
+"""
+Read-your-writes routing for the read replica.
+
+With READ_DATABASE_URL set, the list and report endpoints get their session
+from get_read_session / get_async_read_session (app/api/deps.py), which
+read from the replica. Everything else, and every write, stays on
+DATABASE_URL. A replica lags the primary slightly, so a user who just saved a
+move could reload the list and not find it. To prevent that, a user's reads
+go to the primary for READ_AFTER_WRITE_SECONDS after they make any
+POST/PUT/PATCH/DELETE request. Keep the window above the replica's usual
+replay lag (pg_stat_replication.replay_lag on the primary). Other users may
+see the change up to that lag later.
+
+ReadAfterWriteMiddleware records the writes. get_current_user reports which
+user a write request belongs to. The user is marked when the response
+starts, whatever its status, since a failed request may still have
+committed part of its work. Marks are kept per worker. With
+READ_AFTER_WRITE_DIR set, each mark also touches a file named after the user
+in that directory. Every worker on the host shares the directory, so a read
+that lands on a different worker than the write still goes to the primary.
+Checking costs one stat() call, and only for users with no recent mark in
+this worker.
+
+Without READ_DATABASE_URL, the read dependencies return the primary session
+and the middleware is not installed.
+"""
+import os
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Optional
+
+from app.core.config import settings
+
+SAFE_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+MAX_TRACKED_USERS = 10_000  # Expired marks are dropped beyond this
+
+class RecentWrites:
+    """When each user last made a write request"""
+
+    def __init__(self, window_seconds: float, directory: Optional[str] = None):
+        self.window_seconds = window_seconds
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._written: Dict[int, float] = {}  # user id -> time.time() of their last write
+
+    def _path(self, user_id: int) -> str:
+        return os.path.join(self.directory, str(user_id))
+
+    def mark(self, user_id: int) -> None:
+        now = time.time()
+        with self._lock:
+            self._written[user_id] = now
+            if len(self._written) > MAX_TRACKED_USERS:
+                self._written = {
+                    uid: written for uid, written in self._written.items() if now - written < self.window_seconds
+                }
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            # Other workers compare the file's mtime against the window
+            Path(self._path(user_id)).touch()
+
+    def wrote_recently(self, user_id: int) -> bool:
+        now = time.time()
+        with self._lock:
+            written = self._written.get(user_id)
+        if (written is None or now - written >= self.window_seconds) and self.directory:
+            try:
+                written = os.stat(self._path(user_id)).st_mtime
+            except OSError:
+                pass
+        return written is not None and now - written < self.window_seconds
+
+recent_writes = RecentWrites(settings.READ_AFTER_WRITE_SECONDS, settings.READ_AFTER_WRITE_DIR or None)
+
+def replica_enabled() -> bool:
+    return bool(settings.READ_DATABASE_URL)
+
+def use_replica(user_id: int) -> bool:
+    """Whether this user's reads can go to the replica now"""
+    return replica_enabled() and not recent_writes.wrote_recently(user_id)
+
+class _WriteRequest:
+    __slots__ = ("user_id",)
+
+    def __init__(self):
+        self.user_id: Optional[int] = None
+
+_write_request: ContextVar[Optional[_WriteRequest]] = ContextVar("write_request", default=None)
+
+def note_user(user_id: int) -> None:
+    """Called by get_current_user: the request being served, if a write, is this user's"""
+    request = _write_request.get()
+    if request is not None:
+        request.user_id = user_id
+
+class ReadAfterWriteMiddleware:
+    """Marks the user of each write request in recent_writes (pure ASGI, no buffering)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            return await self.app(scope, receive, send)
+        request = _WriteRequest()
+        marked = False
+
+        async def send_after_mark(message):
+            nonlocal marked
+            # Mark before the client can see the response and issue its next read
+            if message["type"] == "http.response.start" and request.user_id is not None:
+                recent_writes.mark(request.user_id)
+                marked = True
+            await send(message)
+
+        token = _write_request.set(request)
+        try:
+            await self.app(scope, receive, send_after_mark)
+        finally:
+            _write_request.reset(token)
+            if not marked and request.user_id is not None:
+                recent_writes.mark(request.user_id)
@@ -0,0 +1,153 @@
+"""
+Daily stock move rollups for trend reports.
+
+MoveDailyRollup holds move counts and quantity sums per (creation day,
+product, source warehouse, destination warehouse, move type, status). The
+move endpoints update it in the same transaction as the moves themselves:
+creating a move adds it under "draft", and a status change moves it from the
+old status to the new one. Trend queries therefore read a few rows per day
+instead of scanning stockmove.
+
+rebuild_rollups() recomputes the whole table from stockmove with one
+INSERT ... SELECT (see migrate_add_move_rollups.py).
+"""
+from collections import Counter
+from datetime import date
+from typing import List, Optional, Tuple
+
+from sqlalchemy import Date, cast, delete, func, insert, type_coerce
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select
+
+from app.models.inventory import StockMove
+from app.models.rollup import MoveDailyRollup
+
+# (day, product_id, source_warehouse_id, dest_warehouse_id, move_type, status)
+RollupKey = Tuple[date, int, int, int, str, str]
+
+BUCKETS = ("day", "week", "month")
+
+def rollup_key(move: StockMove, status: Optional[str] = None) -> RollupKey:
+    return (
+        move.created_at.date(),
+        move.product_id,
+        move.source_warehouse_id or 0,
+        move.dest_warehouse_id or 0,
+        move.move_type,
+        status or move.status
+    )
+
+class RollupDeltas:
+    """Accumulates rollup changes for a set of moves, written with one upsert"""
+
+    def __init__(self):
+        self.quantities: Counter = Counter()
+        self.counts: Counter = Counter()
+
+    def add(self, move: StockMove, status: Optional[str] = None, sign: int = 1) -> None:
+        key = rollup_key(move, status)
+        self.quantities[key] += sign * move.quantity
+        self.counts[key] += sign
+
+    def status_changed(self, move: StockMove, old_status: str, new_status: str) -> None:
+        self.add(move, old_status, sign=-1)
+        self.add(move, new_status)
+
+    def apply(self, session: Session) -> None:
+        rows = [
+            {
+                "day": key[0], "product_id": key[1], "source_warehouse_id": key[2],
+                "dest_warehouse_id": key[3], "move_type": key[4], "status": key[5],
+                "quantity": self.quantities[key], "move_count": count
+            }
+            for key, count in sorted(self.counts.items())
+            if count or self.quantities[key]
+        ]
+        if not rows:
+            return
+        table = MoveDailyRollup.__table__
+        dialect = session.get_bind().dialect.name
+        insert_ = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert_(table).values(rows)
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=[c.name for c in table.primary_key.columns],
+            set_={
+                "quantity": table.c.quantity + stmt.excluded.quantity,
+                "move_count": table.c.move_count + stmt.excluded.move_count
+            }
+        ))
+
+def record_status_change(session: Session, move: StockMove, old_status: str, new_status: str) -> None:
+    deltas = RollupDeltas()
+    deltas.status_changed(move, old_status, new_status)
+    deltas.apply(session)
+
+def rebuild_rollups(session: Session) -> int:
+    """Recompute every rollup row from stockmove and commit. Returns the number of rows."""
+    day = func.date(StockMove.created_at)
+    source = func.coalesce(StockMove.source_warehouse_id, 0)
+    dest = func.coalesce(StockMove.dest_warehouse_id, 0)
+    aggregate = select(
+        day, StockMove.product_id, source, dest, StockMove.move_type, StockMove.status,
+        func.sum(StockMove.quantity), func.count()
+    ).group_by(day, StockMove.product_id, source, dest, StockMove.move_type, StockMove.status)
+
+    table = MoveDailyRollup.__table__
+    session.execute(delete(table))
+    session.execute(insert(table).from_select(
+        ["day", "product_id", "source_warehouse_id", "dest_warehouse_id", "move_type", "status",
+         "quantity", "move_count"],
+        aggregate
+    ))
+    session.commit()
+    return session.exec(select(func.count()).select_from(MoveDailyRollup)).one()
+
+def bucket_start(session: Session, bucket: str):
+    """SQL expression for the first day of the bucket containing MoveDailyRollup.day (weeks start on Monday)"""
+    day = MoveDailyRollup.day
+    if bucket == "day":
+        return day
+    if session.get_bind().dialect.name == "postgresql":
+        return cast(func.date_trunc(bucket, day), Date)
+    if bucket == "week":
+        return type_coerce(func.date(day, "weekday 0", "-6 days"), Date)
+    return type_coerce(func.date(day, "start of month"), Date)
+
+def movement_trends(
+    session: Session,
+    bucket: str = "day",
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    product_id: Optional[int] = None,
+    warehouse_id: Optional[int] = None,
+    move_type: Optional[str] = None,
+    status: Optional[str] = None
+) -> List[dict]:
+    """Move counts and quantities per bucket and move type, read from the rollup table"""
+    period = bucket_start(session, bucket).label("period")
+    query = select(
+        period,
+        MoveDailyRollup.move_type,
+        func.sum(MoveDailyRollup.quantity),
+        func.sum(MoveDailyRollup.move_count)
+    ).group_by(period, MoveDailyRollup.move_type).order_by(period, MoveDailyRollup.move_type)
+    if date_from:
+        query = query.where(MoveDailyRollup.day >= date_from)
+    if date_to:
+        query = query.where(MoveDailyRollup.day <= date_to)
+    if product_id:
+        query = query.where(MoveDailyRollup.product_id == product_id)
+    if warehouse_id:
+        query = query.where(
+            (MoveDailyRollup.source_warehouse_id == warehouse_id) |
+            (MoveDailyRollup.dest_warehouse_id == warehouse_id)
+        )
+    if move_type:
+        query = query.where(MoveDailyRollup.move_type == move_type)
+    if status:
+        query = query.where(MoveDailyRollup.status == status)
+    return [
+        {"period": row_period, "move_type": row_move_type, "quantity": quantity or 0, "moves": moves}
+        for row_period, row_move_type, quantity, moves in session.exec(query)
+        if moves
+    ]
@@ -0,0 +1,61 @@
+"""
+Case-insensitive substring search over stock moves.
+
+Matches the move reference, source/destination locations and the product
+name/SKU, and ranks results by relevance.
+
+PostgreSQL: ILIKE '%term%' is served by pg_trgm GIN indexes (see
+migrate_add_search_indexes.py) and results are ranked by trigram
+similarity().
+
+SQLite (tests/dev): there is no trigram index, so the same filter runs as a
+full scan. SQLite's LIKE is already case-insensitive for ASCII, and ranking
+falls back to a CASE expression: SKU/reference prefix matches first, then
+other SKU/reference matches, then name and location matches.
+"""
+from sqlalchemy import case, func, literal, or_
+from sqlalchemy.sql import Select
+from sqlmodel import Session, select
+
+from app.models.inventory import StockMove
+from app.models.product import Product
+
+def _like_pattern(term: str, prefix_only: bool = False) -> str:
+    """Escape LIKE wildcards in user input"""
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%" if prefix_only else f"%{escaped}%"
+
+def _ilike(column, pattern: str):
+    return column.ilike(pattern, escape="\\")
+
+def search_moves(query: Select, term: str, session: Session) -> Select:
+    """Filter a StockMove query by search term and order it by relevance (best first)"""
+    pattern = _like_pattern(term)
+    matching_products = select(Product.id).where(
+        or_(_ilike(Product.name, pattern), _ilike(Product.sku, pattern))
+    )
+    query = query.join(Product, Product.id == StockMove.product_id).where(
+        or_(
+            _ilike(StockMove.reference, pattern),
+            _ilike(StockMove.source_location, pattern),
+            _ilike(StockMove.dest_location, pattern),
+            StockMove.product_id.in_(matching_products)
+        )
+    )
+
+    if session.get_bind().dialect.name == "postgresql":
+        rank = func.greatest(
+            func.similarity(StockMove.reference, term),
+            func.similarity(Product.sku, term),
+            func.similarity(Product.name, term),
+            func.similarity(StockMove.source_location, term),
+            func.similarity(StockMove.dest_location, term)
+        )
+    else:
+        prefix = _like_pattern(term, prefix_only=True)
+        rank = case(
+            (or_(_ilike(Product.sku, prefix), _ilike(StockMove.reference, prefix)), literal(3)),
+            (or_(_ilike(Product.sku, pattern), _ilike(StockMove.reference, pattern)), literal(2)),
+            else_=literal(1)
+        )
+    return query.order_by(rank.desc())
@@ -1,10 +1,24 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Callable, Optional, Tuple
+from fastapi import HTTPException
 from jose import jwt
 from passlib.context import CryptContext
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+logger = logging.getLogger(__name__)
+
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__time_cost=settings.ARGON2_TIME_COST,
+    argon2__memory_cost=settings.ARGON2_MEMORY_COST,
+    argon2__parallelism=settings.ARGON2_PARALLELISM
+)
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -12,6 +26,88 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+class HashPool:
+    """
+    Dedicated threads for Argon2 work, so a login rush can't occupy the
+    threadpool shared by every sync endpoint. argon2-cffi releases the GIL
+    while hashing, so the threads run in parallel.
+
+    At most max_pending calls may be waiting or running; beyond that callers
+    get 503 with Retry-After instead of queueing without bound.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="argon2")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._started = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+
+    async def run(self, fn: Callable, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                logger.warning(f"Password hashing pool saturated ({self._pending} pending), rejecting request")
+                raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+            self._pending += 1
+        queued_at = time.perf_counter()
+
+        def call():
+            waited = time.perf_counter() - queued_at
+            with self._lock:
+                self._running += 1
+                self._started += 1
+                self._wait_seconds_total += waited
+                self._wait_seconds_max = max(self._wait_seconds_max, waited)
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+
+        def release(_):
+            with self._lock:
+                self._pending -= 1
+
+        # The slot is freed when the hash finishes (or is cancelled before it
+        # starts), not when the awaiting request goes away
+        try:
+            future = self._executor.submit(call)
+        except BaseException:
+            release(None)
+            raise
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        """Queueing and back-pressure counters since startup"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "wait_seconds_avg": self._wait_seconds_total / self._started if self._started else 0.0,
+                "wait_seconds_max": self._wait_seconds_max
+            }
+
+hash_pool = HashPool(settings.HASH_POOL_WORKERS, settings.HASH_POOL_MAX_PENDING)
+
+async def get_password_hash_async(password: str) -> str:
+    return await hash_pool.run(pwd_context.hash, password)
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify on the hash pool; the second item is a new hash when the stored one uses outdated parameters"""
+    return await hash_pool.run(pwd_context.verify_and_update, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
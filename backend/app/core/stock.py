@@ -0,0 +1,198 @@
+"""
+Set-based stock updates shared by the move validation endpoints.
+
+Stock is only ever changed with conditional atomic UPDATEs
+(quantity = quantity - :q WHERE quantity >= :q) and upserts on the
+ProductStock (product_id, warehouse_id) unique constraint, never with
+read-modify-write in Python. Rows are always locked in the same order - stock
+moves by id, then products by id, then ProductStock by (product_id,
+warehouse_id) - so concurrent validations wait on each other instead of
+deadlocking.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select, col
+
+from app.models.inventory import StockMove, ProductStock
+from app.models.product import DEFAULT_LOW_STOCK_THRESHOLD, Product
+
+StockKey = Tuple[int, int]  # (product_id, warehouse_id)
+
+def is_low_stock(current_stock: int, min_stock_level: Optional[int]) -> bool:
+    """Python twin of low_stock_predicate() in app/models/product.py"""
+    threshold = min_stock_level if min_stock_level is not None else DEFAULT_LOW_STOCK_THRESHOLD
+    return current_stock < threshold
+
+def lock_moves(session: Session, move_ids: Iterable[int]) -> List[StockMove]:
+    return session.exec(
+        select(StockMove)
+        .where(col(StockMove.id).in_(set(move_ids)))
+        .order_by(StockMove.id)
+        .with_for_update()
+    ).all()
+
+def lock_products(session: Session, product_ids: Iterable[int]) -> Dict[int, Tuple[int, Optional[int]]]:
+    """Lock products and return (current_stock, min_stock_level) by id"""
+    rows = session.exec(
+        select(Product.id, Product.current_stock, Product.min_stock_level)
+        .where(col(Product.id).in_(set(product_ids)))
+        .order_by(Product.id)
+        .with_for_update()
+    ).all()
+    return {product_id: (current_stock, min_stock_level) for product_id, current_stock, min_stock_level in rows}
+
+def lock_product_stocks(session: Session, keys: Iterable[StockKey]) -> Dict[StockKey, int]:
+    """Lock existing ProductStock rows and return their quantity by (product_id, warehouse_id)"""
+    keys = set(keys)
+    if not keys:
+        return {}
+    rows = session.exec(
+        select(ProductStock.product_id, ProductStock.warehouse_id, ProductStock.quantity)
+        .where(tuple_(ProductStock.product_id, ProductStock.warehouse_id).in_(keys))
+        .order_by(ProductStock.product_id, ProductStock.warehouse_id)
+        .with_for_update()
+    ).all()
+    return {(product_id, warehouse_id): quantity for product_id, warehouse_id, quantity in rows}
+
+def move_deltas(move: StockMove) -> Tuple[int, Dict[StockKey, int]]:
+    """Stock changes a move applies when validated: (product delta, warehouse deltas)"""
+    if move.move_type == "IN":
+        # Receipts land in the warehouse recorded on the move, if any
+        warehouse_deltas = {(move.product_id, move.source_warehouse_id): move.quantity} if move.source_warehouse_id else {}
+        return move.quantity, warehouse_deltas
+    if move.move_type == "OUT":
+        return -move.quantity, {}
+    if move.move_type == "ADJ":
+        # For adjustments, quantity can be negative or positive
+        return move.quantity, {}
+    if move.move_type == "INT":
+        return 0, {
+            (move.product_id, move.source_warehouse_id): -move.quantity,
+            (move.product_id, move.dest_warehouse_id): move.quantity,
+        }
+    return 0, {}
+
+def check_move(move: StockMove, product_stock: Optional[int], warehouse_stock: Dict[StockKey, int]) -> Optional[str]:
+    """Return why a move can't be validated against the given balances, or None"""
+    if move.status == "done":
+        return "Move already validated"
+    if move.status == "cancelled":
+        return "Cannot validate a cancelled move"
+    if product_stock is None:
+        return "Product not found"
+    if move.move_type == "OUT" and product_stock < move.quantity:
+        return f"Insufficient stock. Available: {product_stock}, Required: {move.quantity}"
+    if move.move_type == "INT":
+        if not move.source_warehouse_id or not move.dest_warehouse_id:
+            return "Source and destination warehouses required for internal transfers"
+        available = warehouse_stock.get((move.product_id, move.source_warehouse_id), 0)
+        if available < move.quantity:
+            return f"Insufficient stock in source warehouse. Available: {available}, Required: {move.quantity}"
+    return None
+
+def claim_move(session: Session, move_id: int) -> Optional[Tuple[StockMove, str]]:
+    """
+    Atomically mark a move done if it is still open.
+
+    Returns the updated move and the status it had before, or None when the
+    move doesn't exist or is already done/cancelled. The status is set with a
+    compare-and-set (UPDATE ... WHERE status = :previous), so a concurrent
+    second validation waits on the row lock and then finds the move done.
+    """
+    table = StockMove.__table__
+    while True:
+        previous_status = session.exec(select(StockMove.status).where(StockMove.id == move_id)).first()
+        if previous_status is None or previous_status in ("done", "cancelled"):
+            return None
+        row = session.execute(
+            update(table)
+            .where((table.c.id == move_id) & (table.c.status == previous_status))
+            .values(status="done")
+            .returning(*table.c)
+        ).first()
+        if row:
+            return StockMove.model_validate(row._mapping), previous_status
+        # Status changed between the read and the update; look again
+
+def adjust_product_stock(session: Session, product_id: int, delta: int, guard: bool = False):
+    """
+    Add delta to Product.current_stock in one statement.
+
+    Returns the row's new (current_stock, min_stock_level). With guard, the
+    update only happens if stock stays non-negative. Returns None when no row
+    matched (missing product, or guard failed).
+    """
+    table = Product.__table__
+    condition = table.c.id == product_id
+    if guard:
+        condition = condition & (table.c.current_stock + delta >= 0)
+    return session.execute(
+        update(table)
+        .where(condition)
+        .values(current_stock=table.c.current_stock + delta)
+        .returning(table.c.current_stock, table.c.min_stock_level)
+    ).first()
+
+def take_warehouse_stock(session: Session, product_id: int, warehouse_id: int, quantity: int) -> Optional[int]:
+    """Remove quantity from a warehouse only if enough is there; None if not"""
+    table = ProductStock.__table__
+    return session.execute(
+        update(table)
+        .where(
+            (table.c.product_id == product_id) &
+            (table.c.warehouse_id == warehouse_id) &
+            (table.c.quantity >= quantity)
+        )
+        .values(quantity=table.c.quantity - quantity)
+        .returning(table.c.quantity)
+    ).scalar_one_or_none()
+
+def upsert_warehouse_stock(session: Session, deltas: Dict[StockKey, int]) -> None:
+    """Add deltas to ProductStock rows, creating missing rows, in one multi-row upsert"""
+    rows = [
+        {"product_id": p, "warehouse_id": w, "quantity": delta}
+        for (p, w), delta in sorted(deltas.items())
+        if delta
+    ]
+    if not rows:
+        return
+    dialect = session.get_bind().dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert(ProductStock.__table__).values(rows)
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=["product_id", "warehouse_id"],
+        set_={"quantity": ProductStock.__table__.c.quantity + stmt.excluded.quantity}
+    ))
+
+def available_stock(session: Session, product_id: int, warehouse_id: Optional[int] = None) -> Optional[int]:
+    """Current product or warehouse stock, for error messages. None if no row exists."""
+    if warehouse_id is None:
+        return session.exec(select(Product.current_stock).where(Product.id == product_id)).first()
+    return session.exec(
+        select(ProductStock.quantity).where(
+            (ProductStock.product_id == product_id) &
+            (ProductStock.warehouse_id == warehouse_id)
+        )
+    ).first()
+
+def apply_stock_deltas(session: Session, product_deltas: Dict[int, int], stock_deltas: Dict[StockKey, int]) -> None:
+    """Apply merged deltas with one UPDATE for products and one upsert for ProductStock"""
+    product_deltas = {k: v for k, v in sorted(product_deltas.items()) if v}
+    if product_deltas:
+        session.execute(
+            update(Product.__table__)
+            .where(Product.__table__.c.id == bindparam("b_id"))
+            .values(current_stock=Product.__table__.c.current_stock + bindparam("b_delta")),
+            [{"b_id": k, "b_delta": v} for k, v in product_deltas.items()]
+        )
+    upsert_warehouse_stock(session, stock_deltas)
+
+def mark_moves_done(session: Session, move_ids: List[int]) -> None:
+    if move_ids:
+        session.execute(
+            update(StockMove.__table__)
+            .where(StockMove.__table__.c.id.in_(move_ids))
+            .values(status="done")
+        )
@@ -2,13 +2,27 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from app.core.config import settings
-from app.core.database import create_db_and_tables
-from app.api import auth, products, operations, warehouses, reports, vendors, customers, categories
+from app.core.database import async_engine, async_read_engine, create_db_and_tables, engine
+from app.core.db_metrics import RequestMetricsMiddleware
+from app.core.email import mail_queue
+from app.core.metrics import PrometheusMiddleware, metrics_response, worker_stopped
+from app.core.profiling import ProfilerMiddleware, profiling_enabled
+from app.core.replica import ReadAfterWriteMiddleware, replica_enabled
+from app.core.pagination import NEXT_CURSOR_HEADER
+from app.core.product_index import product_index
+from app.api import auth, products, operations, warehouses, reports, vendors, customers, categories, system
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_and_tables()
+    product_index.build(engine)
+    await mail_queue.start()
     yield
+    await mail_queue.stop()
+    await async_engine.dispose()
+    if async_read_engine is not async_engine:
+        await async_read_engine.dispose()
+    worker_stopped()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -23,7 +37,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(PrometheusMiddleware)
+if profiling_enabled():
+    app.add_middleware(ProfilerMiddleware)
+if replica_enabled():
+    app.add_middleware(ReadAfterWriteMiddleware)
 
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(products.router, prefix="/products", tags=["products"])
@@ -33,7 +54,13 @@ app.include_router(categories.router, prefix="/categories", tags=["categories"])
 app.include_router(vendors.router, prefix="/vendors", tags=["vendors"])
 app.include_router(customers.router, prefix="/customers", tags=["customers"])
 app.include_router(reports.router, prefix="/reports", tags=["reports"])
+app.include_router(system.router, prefix="/system", tags=["system"])
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to StockMaster API"}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus scrape endpoint (see app/core/metrics.py)"""
+    return metrics_response()
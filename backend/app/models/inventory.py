@@ -1,4 +1,5 @@
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index, UniqueConstraint
 from typing import Optional
 from datetime import datetime
 
@@ -22,8 +23,24 @@ class StockMove(SQLModel, table=True):
     status: str = "draft" # draft, waiting, ready, done, cancelled
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+# Keyset pagination of move lists (newest first), plain and filtered by type/status
+Index("ix_stockmove_created_at_id", StockMove.created_at.desc(), StockMove.id.desc())
+Index("ix_stockmove_move_type_created_at_id", StockMove.move_type, StockMove.created_at.desc(), StockMove.id.desc())
+Index("ix_stockmove_status_created_at_id", StockMove.status, StockMove.created_at.desc(), StockMove.id.desc())
+
 class ProductStock(SQLModel, table=True):
+    # One row per product and warehouse; stock updates upsert on this key
+    __table_args__ = (UniqueConstraint("product_id", "warehouse_id", name="uq_productstock_product_warehouse"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     product_id: int = Field(foreign_key="product.id")
     warehouse_id: int = Field(foreign_key="warehouse.id")
     quantity: int = Field(default=0)
+    min_quantity: Optional[int] = Field(default=None)  # Per-warehouse low-stock threshold (none = no alert)
+
+# Low-stock rows of each warehouse, in product order (GET /products/low-stock?warehouse_id=)
+Index(
+    "ix_productstock_low_stock", ProductStock.warehouse_id, ProductStock.product_id,
+    postgresql_where=ProductStock.quantity < ProductStock.min_quantity,
+    sqlite_where=ProductStock.quantity < ProductStock.min_quantity
+)
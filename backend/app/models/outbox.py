@@ -0,0 +1,20 @@
+from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
+from typing import Optional
+from datetime import datetime
+
+class EmailOutbox(SQLModel, table=True):
+    """Outgoing email, written in the same transaction as the change that needs it and delivered by app/core/email.py"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    recipient: str
+    subject: str
+    html_body: str
+    status: str = Field(default="pending")  # pending, sent, failed
+    attempts: int = Field(default=0)
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)  # Also the claim lease while a worker is sending
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    sent_at: Optional[datetime] = None
+
+# Due messages are picked by (status, next_attempt_at)
+Index("ix_emailoutbox_status_next_attempt_at", EmailOutbox.status, EmailOutbox.next_attempt_at)
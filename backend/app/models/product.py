@@ -1,6 +1,10 @@
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Index, func, literal_column
 from typing import Optional
 
+# Products without min_stock_level count as low stock below this
+DEFAULT_LOW_STOCK_THRESHOLD = 10
+
 class Product(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(index=True)
@@ -10,3 +14,13 @@ class Product(SQLModel, table=True):
     uom: str # Unit of Measure
     current_stock: int = Field(default=0)
     min_stock_level: Optional[int] = Field(default=None)  # Minimum stock level for reordering alerts
+
+def low_stock_predicate():
+    """current_stock < min_stock_level, or < 10 when unset"""
+    # The default is inlined rather than bound: a query only uses the partial index below when
+    # its WHERE contains this exact expression
+    return Product.current_stock < func.coalesce(Product.min_stock_level, literal_column(str(DEFAULT_LOW_STOCK_THRESHOLD)))
+
+# Low-stock products in id order (GET /products/low-stock). The database keeps a partial
+# index current on every write, so it lists them without scanning the catalog.
+Index("ix_product_low_stock", Product.id, postgresql_where=low_stock_predicate(), sqlite_where=low_stock_predicate())
@@ -0,0 +1,13 @@
+from sqlmodel import SQLModel, Field
+from datetime import date
+
+class MoveDailyRollup(SQLModel, table=True):
+    """Stock move totals per creation day and current status, kept in step with StockMove (see app/core/rollups.py)"""
+    day: date = Field(primary_key=True)
+    product_id: int = Field(primary_key=True)
+    source_warehouse_id: int = Field(default=0, primary_key=True)  # 0 when the move has no source warehouse
+    dest_warehouse_id: int = Field(default=0, primary_key=True)  # 0 when the move has no destination warehouse
+    move_type: str = Field(primary_key=True)
+    status: str = Field(primary_key=True)
+    quantity: int = Field(default=0)  # Sum of move quantities
+    move_count: int = Field(default=0)
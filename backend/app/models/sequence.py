@@ -0,0 +1,7 @@
+from sqlmodel import SQLModel, Field
+
+class ReferenceSequence(SQLModel, table=True):
+    """Per-(prefix, year) counter backing stock move references (AW/YYYY/0001)"""
+    prefix: str = Field(primary_key=True)
+    year: int = Field(primary_key=True)
+    last_value: int = Field(default=0)  # Last serial handed out for this prefix/year
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
-from typing import Optional
-from datetime import datetime
+from typing import List, Optional
+from datetime import date, datetime
 
 class StockMoveBase(BaseModel):
     product_id: int
@@ -21,3 +21,34 @@ class StockMoveRead(StockMoveBase):
     reference: Optional[str] = None
     status: str
     created_at: datetime
+
+class StockMoveBatchCreate(BaseModel):
+    moves: List[StockMoveCreate]
+    all_or_nothing: bool = True  # Reject the whole batch if any item is invalid
+
+class StockMoveBatchError(BaseModel):
+    index: int  # Position of the item in the submitted list
+    detail: str
+
+class StockMoveBatchResult(BaseModel):
+    created: List[StockMoveRead]
+    errors: List[StockMoveBatchError] = []
+
+class StockMoveBatchValidate(BaseModel):
+    move_ids: List[int]
+    all_or_nothing: bool = True  # Validate nothing if any move fails
+
+class StockMoveValidationResult(BaseModel):
+    move_id: int
+    success: bool
+    detail: Optional[str] = None
+
+class StockMoveBatchValidateResult(BaseModel):
+    validated: int
+    results: List[StockMoveValidationResult]
+
+class MovementTrendPoint(BaseModel):
+    period: date  # First day of the day/week/month bucket
+    move_type: str
+    quantity: int
+    moves: int
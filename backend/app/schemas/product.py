@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
 class ProductBase(BaseModel):
     name: str
@@ -17,9 +17,59 @@ class ProductRead(ProductBase):
     current_stock: int
     category_name: Optional[str] = None  # Include category name in response
 
+class StockLocation(BaseModel):
+    warehouse_id: int
+    warehouse_name: str
+    warehouse_location: str
+    quantity: int
+
+class ProductListRead(ProductRead):
+    stock_by_location: Optional[List[StockLocation]] = None  # Only with include=stock_by_location
+
+class LowStockItem(BaseModel):
+    id: int
+    sku: str
+    name: str
+    current_stock: int  # Product total, or the warehouse's quantity with warehouse_id
+    threshold: int  # min_stock_level (10 when unset), or the warehouse's min_quantity
+    warehouse_id: Optional[int] = None
+
+class StockThresholdUpdate(BaseModel):
+    min_quantity: Optional[int] = None  # None removes the threshold
+
+class StockThreshold(BaseModel):
+    product_id: int
+    warehouse_id: int
+    quantity: int
+    min_quantity: Optional[int] = None
+
+class ProductBulkGet(BaseModel):
+    ids: List[int] = []
+    skus: List[str] = []
+    include_stock: bool = False  # Add each product's per-warehouse stock
+
+class ProductLookupItem(BaseModel):
+    id: int
+    sku: str
+    name: str
+
 class ProductUpdate(BaseModel):
     name: Optional[str] = None
     category_id: Optional[int] = None
     category: Optional[str] = None  # For backward compatibility
     uom: Optional[str] = None
     min_stock_level: Optional[int] = None
+
+class ProductImportError(BaseModel):
+    line: int  # Line of the row in the file (the CSV header is line 1)
+    detail: str
+
+class ProductImportResult(BaseModel):
+    rows: int  # Data rows read
+    created: int  # New products
+    updated: int  # Existing products, matched by SKU
+    categories_created: int
+    stock_rows: int  # ProductStock rows seeded for the new products
+    stock_skipped: int  # Rows with initial stock for existing products (not applied)
+    error_count: int  # Invalid rows, skipped unless all_or_nothing
+    errors: List[ProductImportError] = []  # The first ones, up to a limit
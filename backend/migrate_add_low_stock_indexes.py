@@ -0,0 +1,49 @@
+"""
+Migration script for the low-stock listing (GET /products/low-stock): adds
+productstock.min_quantity (per-warehouse thresholds) and the partial indexes
+holding only low-stock products and ProductStock rows.
+"""
+import sys
+from sqlalchemy import inspect
+from sqlmodel import text
+from app.core.database import engine
+from app.core.config import settings
+
+# Predicates must match app/models/product.py and app/models/inventory.py exactly,
+# or the planner won't use the indexes
+INDEXES = {
+    "ix_product_low_stock": "product (id) WHERE current_stock < coalesce(min_stock_level, 10)",
+    "ix_productstock_low_stock": "productstock (warehouse_id, product_id) WHERE quantity < min_quantity",
+}
+
+def migrate_add_low_stock_indexes():
+    """Add productstock.min_quantity and the low-stock partial indexes"""
+    print("🔵 Starting migration: Adding low-stock threshold column and indexes...")
+
+    # CONCURRENTLY keeps the tables writable on PostgreSQL but can't run inside a transaction
+    concurrently = "CONCURRENTLY " if "postgresql" in settings.DATABASE_URL.lower() else ""
+    try:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            columns = {column["name"] for column in inspect(conn).get_columns("productstock")}
+            if "min_quantity" in columns:
+                print("⚠️  productstock.min_quantity already exists. Skipping...")
+            else:
+                print("📝 Adding min_quantity column to productstock...")
+                conn.execute(text("ALTER TABLE productstock ADD COLUMN min_quantity INTEGER"))
+
+            for name, definition in INDEXES.items():
+                print(f"📝 Creating {name}...")
+                conn.execute(text(f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {definition}"))
+
+        print("✅ Migration completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        print("\nYou may need to run this manually:")
+        print("   ALTER TABLE productstock ADD COLUMN min_quantity INTEGER;")
+        for name, definition in INDEXES.items():
+            print(f"   CREATE INDEX IF NOT EXISTS {name} ON {definition};")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    migrate_add_low_stock_indexes()
@@ -0,0 +1,47 @@
+"""
+Migration script to add the movedailyrollup table and fill it from the
+existing stock moves.
+Safe to run more than once: the rollups are rebuilt from scratch each time,
+so this also serves as the backfill/repair command.
+"""
+import sys
+from sqlmodel import Session
+from app.core.database import engine
+from app.core.rollups import rebuild_rollups
+from app.models.rollup import MoveDailyRollup
+
+def migrate_add_move_rollups():
+    """Add movedailyrollup table and rebuild it from stockmove"""
+    print("🔵 Starting migration: Adding movedailyrollup table...")
+
+    try:
+        print("📝 Creating movedailyrollup table (if missing)...")
+        MoveDailyRollup.__table__.create(engine, checkfirst=True)
+
+        print("📝 Rebuilding rollups from existing stock moves...")
+        with Session(engine) as session:
+            rows = rebuild_rollups(session)
+
+        print("✅ Migration completed successfully!")
+        print(f"   - {rows} rollup rows")
+
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        print("\nYou may need to run this manually:")
+        print("""
+        CREATE TABLE IF NOT EXISTS movedailyrollup (
+            day DATE NOT NULL,
+            product_id INTEGER NOT NULL,
+            source_warehouse_id INTEGER NOT NULL DEFAULT 0,
+            dest_warehouse_id INTEGER NOT NULL DEFAULT 0,
+            move_type VARCHAR NOT NULL,
+            status VARCHAR NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            move_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, product_id, source_warehouse_id, dest_warehouse_id, move_type, status)
+        );
+        """)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    migrate_add_move_rollups()
@@ -0,0 +1,76 @@
+"""
+Migration script to make ProductStock unique per (product_id, warehouse_id).
+Duplicate rows are merged into the oldest one (quantities summed) first.
+Stock validation upserts on this key, so run this before deploying it.
+"""
+import sys
+from sqlmodel import Session, text
+from app.core.database import engine
+from app.core.config import settings
+
+MERGE_DUPLICATES = """
+    UPDATE productstock
+    SET quantity = (
+        SELECT SUM(d.quantity) FROM productstock d
+        WHERE d.product_id = productstock.product_id
+          AND d.warehouse_id = productstock.warehouse_id
+    )
+    WHERE id IN (
+        SELECT MIN(id) FROM productstock
+        GROUP BY product_id, warehouse_id
+        HAVING COUNT(*) > 1
+    )
+"""
+
+DELETE_DUPLICATES = """
+    DELETE FROM productstock
+    WHERE id NOT IN (
+        SELECT MIN(id) FROM productstock
+        GROUP BY product_id, warehouse_id
+    )
+"""
+
+def migrate_add_productstock_unique():
+    """Merge duplicate ProductStock rows and add the unique constraint"""
+    print("🔵 Starting migration: Adding unique (product_id, warehouse_id) to productstock...")
+
+    try:
+        with Session(engine) as session:
+            print("📝 Merging duplicate productstock rows...")
+            session.exec(text(MERGE_DUPLICATES))
+            deleted = session.exec(text(DELETE_DUPLICATES)).rowcount
+            print(f"   - {deleted} duplicate rows removed")
+
+            if "postgresql" in settings.DATABASE_URL.lower():
+                check_constraint = text("""
+                    SELECT constraint_name
+                    FROM information_schema.table_constraints
+                    WHERE table_name='productstock' AND constraint_name='uq_productstock_product_warehouse'
+                """)
+                if session.exec(check_constraint).first():
+                    print("⚠️  Constraint already exists. Skipping...")
+                else:
+                    print("📝 Adding unique constraint...")
+                    session.exec(text("""
+                        ALTER TABLE productstock
+                        ADD CONSTRAINT uq_productstock_product_warehouse UNIQUE (product_id, warehouse_id)
+                    """))
+            else:
+                # SQLite can't add constraints to an existing table; a unique index works the same for ON CONFLICT
+                print("📝 Adding unique index...")
+                session.exec(text("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS uq_productstock_product_warehouse
+                    ON productstock(product_id, warehouse_id)
+                """))
+
+            session.commit()
+            print("✅ Migration completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        print("\nYou may need to run this manually:")
+        print("   ALTER TABLE productstock ADD CONSTRAINT uq_productstock_product_warehouse UNIQUE (product_id, warehouse_id);")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    migrate_add_productstock_unique()
@@ -0,0 +1,42 @@
+"""
+Migration script to add the referencesequence counter table and backfill it
+from the references already stored on stock moves.
+Safe to run more than once: counters are only ever moved forward.
+"""
+import sys
+from sqlmodel import Session
+from app.core.database import engine
+from app.core.references import backfill_reference_sequences
+from app.models.sequence import ReferenceSequence
+
+def migrate_add_reference_sequence():
+    """Add referencesequence table and backfill counters"""
+    print("🔵 Starting migration: Adding referencesequence table...")
+
+    try:
+        print("📝 Creating referencesequence table (if missing)...")
+        ReferenceSequence.__table__.create(engine, checkfirst=True)
+
+        print("📝 Backfilling counters from existing references...")
+        with Session(engine) as session:
+            highest = backfill_reference_sequences(session)
+
+        print("✅ Migration completed successfully!")
+        for (prefix, year), serial in sorted(highest.items()):
+            print(f"   - {prefix}/{year}: last serial {serial}")
+
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        print("\nYou may need to run this manually:")
+        print("""
+        CREATE TABLE IF NOT EXISTS referencesequence (
+            prefix VARCHAR NOT NULL,
+            year INTEGER NOT NULL,
+            last_value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (prefix, year)
+        );
+        """)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    migrate_add_reference_sequence()
@@ -0,0 +1,47 @@
+"""
+Migration script to add pg_trgm GIN indexes for stock move search
+(reference, source/destination location, product name and SKU).
+PostgreSQL only - SQLite falls back to unindexed LIKE, see app/core/search.py.
+"""
+import sys
+from sqlmodel import text
+from app.core.database import engine
+from app.core.config import settings
+
+INDEXES = {
+    "ix_stockmove_reference_trgm": "stockmove USING gin (reference gin_trgm_ops)",
+    "ix_stockmove_source_location_trgm": "stockmove USING gin (source_location gin_trgm_ops)",
+    "ix_stockmove_dest_location_trgm": "stockmove USING gin (dest_location gin_trgm_ops)",
+    "ix_product_name_trgm": "product USING gin (name gin_trgm_ops)",
+    "ix_product_sku_trgm": "product USING gin (sku gin_trgm_ops)",
+}
+
+def migrate_add_search_indexes():
+    """Enable pg_trgm and add trigram indexes"""
+    print("🔵 Starting migration: Adding trigram search indexes...")
+
+    if "postgresql" not in settings.DATABASE_URL.lower():
+        print("⚠️  SQLite detected. Trigram indexes are PostgreSQL only; search will use unindexed LIKE.")
+        return
+
+    try:
+        # CONCURRENTLY keeps the tables writable but can't run inside a transaction
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            print("📝 Enabling pg_trgm extension...")
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for name, definition in INDEXES.items():
+                print(f"📝 Creating {name}...")
+                conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"))
+
+        print("✅ Migration completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        print("\nYou may need to run this manually:")
+        print("   CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        for name, definition in INDEXES.items():
+            print(f"   CREATE INDEX IF NOT EXISTS {name} ON {definition};")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    migrate_add_search_indexes()
@@ -0,0 +1,38 @@
+"""
+Migration script to add the indexes behind keyset pagination of stock moves:
+(created_at DESC, id DESC), plus move_type- and status-prefixed variants.
+"""
+import sys
+from sqlmodel import text
+from app.core.database import engine
+from app.core.config import settings
+
+INDEXES = {
+    "ix_stockmove_created_at_id": "stockmove (created_at DESC, id DESC)",
+    "ix_stockmove_move_type_created_at_id": "stockmove (move_type, created_at DESC, id DESC)",
+    "ix_stockmove_status_created_at_id": "stockmove (status, created_at DESC, id DESC)",
+}
+
+def migrate_add_stockmove_pagination_indexes():
+    """Add stock move pagination indexes"""
+    print("🔵 Starting migration: Adding stock move pagination indexes...")
+
+    # CONCURRENTLY keeps the table writable on PostgreSQL but can't run inside a transaction
+    concurrently = "CONCURRENTLY " if "postgresql" in settings.DATABASE_URL.lower() else ""
+    try:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for name, definition in INDEXES.items():
+                print(f"📝 Creating {name}...")
+                conn.execute(text(f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {definition}"))
+
+        print("✅ Migration completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        print("\nYou may need to run this manually:")
+        for name, definition in INDEXES.items():
+            print(f"   CREATE INDEX IF NOT EXISTS {name} ON {definition};")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    migrate_add_stockmove_pagination_indexes()
@@ -0,0 +1,35 @@
+"""
+The tests run the app against a throwaway SQLite database.
+
+DATABASE_URL is set here, before any app module reads the settings.
+"""
+import os
+import tempfile
+
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="stockmaster_tests_"), "test.db")
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import SQLModel
+
+from app.api.deps import get_current_user
+from app.core.database import engine
+from app.main import app
+from app.models.user import User
+
+@pytest.fixture
+def db():
+    """The app's engine, with empty tables"""
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+@pytest.fixture
+def client(db):
+    """The app, authenticated as a staff user without touching the database"""
+    app.dependency_overrides[get_current_user] = lambda: User(
+        id=1, email="test@example.com", password_hash="x", full_name="Test", role="staff"
+    )
+    with TestClient(app) as client:
+        yield client
+    app.dependency_overrides.clear()
@@ -0,0 +1,62 @@
+"""GET /products/ runs a fixed number of queries whatever the page size (no N+1)"""
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event, insert
+from sqlmodel import Session
+
+from app.core.database import async_engine, engine
+from app.models.category import Category
+from app.models.inventory import ProductStock, Warehouse
+from app.models.product import Product
+
+PRODUCTS = 300
+CATEGORIES = 20
+WAREHOUSES = 5
+
+@contextmanager
+def count_queries():
+    """Statements sent to the database, on both of the app's engines"""
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engines = (engine, async_engine.sync_engine)
+    for target in engines:
+        event.listen(target, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        for target in engines:
+            event.remove(target, "before_cursor_execute", record)
+
+@pytest.fixture
+def catalog(db):
+    with Session(db) as session:
+        session.execute(insert(Category), [{"name": f"Category {i}"} for i in range(CATEGORIES)])
+        session.execute(insert(Warehouse), [{"name": f"WH {i}", "location": f"Site {i}"} for i in range(WAREHOUSES)])
+        session.execute(insert(Product), [
+            {"name": f"Product {i}", "sku": f"SKU-{i}", "category": "", "category_id": i % CATEGORIES + 1,
+             "uom": "pcs", "current_stock": 0}
+            for i in range(PRODUCTS)
+        ])
+        session.execute(insert(ProductStock), [
+            {"product_id": p + 1, "warehouse_id": w + 1, "quantity": 10}
+            for p in range(PRODUCTS) for w in range(WAREHOUSES) if (p + w) % 2 == 0
+        ])
+        session.commit()
+
+# Queries per page: the joined product/category query, plus the stock breakdown
+@pytest.mark.parametrize("include, expected", [("", 1), ("stock_by_location", 2)])
+@pytest.mark.parametrize("limit", [10, 100, PRODUCTS])
+def test_product_list_query_count(client, catalog, include, expected, limit):
+    url = f"/products/?limit={limit}" + (f"&include={include}" if include else "")
+    with count_queries() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    products = response.json()
+    assert len(products) == limit
+    assert len(statements) == expected, statements
+    if include:
+        assert all("stock_by_location" in product for product in products)
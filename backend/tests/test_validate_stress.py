@@ -0,0 +1,87 @@
+"""Concurrent move validation never double-validates a move or oversells stock"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import insert
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app.api.operations import _validate_move
+from app.models.inventory import ProductStock, StockMove, Warehouse
+from app.models.product import Product
+
+THREADS = 8
+
+@pytest.fixture
+def stress_engine(tmp_path):
+    # Its own engine: validations wait on SQLite's write lock, longer than the default 5s under load
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'stress.db'}", connect_args={"timeout": 30, "check_same_thread": False}
+    )
+    SQLModel.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+def seed(engine, stock: int, moves: list) -> int:
+    """A product with `stock` units and draft moves of it; returns the product id"""
+    with Session(engine) as session:
+        product = Product(name="Widget", sku="W-1", category="", uom="pcs", current_stock=stock)
+        session.add(product)
+        session.flush()
+        session.execute(insert(StockMove), [
+            {"product_id": product.id, "status": "draft", "created_at": datetime.utcnow(), **move} for move in moves
+        ])
+        session.commit()
+        return product.id
+
+def validate_all(engine, move_ids: list) -> list:
+    def validate(move_id):
+        # The body of validate_stock_move, which runs it on the async connection with run_sync
+        with Session(engine) as session:
+            try:
+                _validate_move(session, move_id)
+                return "done"
+            except HTTPException as e:
+                return e.detail.split(".")[0]
+
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        return list(pool.map(validate, move_ids))
+
+def test_double_validate_does_not_oversell(stress_engine):
+    stock, moves = 100, 250
+    product_id = seed(stress_engine, stock, [{"quantity": 1, "move_type": "OUT"}] * moves)
+    move_ids = list(range(1, moves + 1))
+
+    outcomes = validate_all(stress_engine, move_ids + move_ids)
+
+    with Session(stress_engine) as session:
+        final_stock = session.get(Product, product_id).current_stock
+        done = len(session.exec(select(StockMove.id).where(StockMove.status == "done")).all())
+    assert final_stock == 0
+    assert done == stock
+    assert outcomes.count("done") == done
+
+def test_opposite_transfers_keep_warehouse_stock(stress_engine):
+    transfers = 200
+    with Session(stress_engine) as session:
+        session.execute(insert(Warehouse), [{"name": "A", "location": "a"}, {"name": "B", "location": "b"}])
+        session.commit()
+    product_id = seed(stress_engine, 200, [
+        {"quantity": 1, "move_type": "INT", "source_warehouse_id": 1 + i % 2, "dest_warehouse_id": 2 - i % 2}
+        for i in range(transfers)
+    ])
+    with Session(stress_engine) as session:
+        session.execute(insert(ProductStock), [
+            {"product_id": product_id, "warehouse_id": 1, "quantity": 100},
+            {"product_id": product_id, "warehouse_id": 2, "quantity": 100}
+        ])
+        session.commit()
+
+    outcomes = validate_all(stress_engine, list(range(1, transfers + 1)))
+
+    assert outcomes == ["done"] * transfers
+    with Session(stress_engine) as session:
+        quantities = session.exec(select(ProductStock.quantity).order_by(ProductStock.warehouse_id)).all()
+        assert quantities == [100, 100]
+        assert session.get(Product, product_id).current_stock == 200
@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useMemo } from 'react';
 import api from '../services/api';
-import { useProducts, useCategories } from '../hooks/useApiData';
+import { useApiData, useCategories } from '../hooks/useApiData';
 import { handleApiError, confirmAction } from '../utils/errorHandler';
 import Button from '../components/ui/Button';
 import Input from '../components/ui/Input';
@@ -11,7 +11,8 @@ import Modal from '../components/ui/Modal';
 import { Plus, Edit, Trash2, MapPin } from 'lucide-react';
 
 const Products = () => {
-  const { data: products, loading, refetch: refetchProducts } = useProducts();
+  // Each product comes with its per-warehouse stock, shown by the Stock Locations dialog
+  const { data: products, loading, refetch: refetchProducts } = useApiData('/products/?include=stock_by_location');
   const { data: categories } = useCategories();
   const [showModal, setShowModal] = useState(false);
   const [editingProduct, setEditingProduct] = useState(null);
@@ -102,14 +103,13 @@ const Products = () => {
     }
   };
 
-  const fetchStockLocations = async (productId) => {
-    try {
-      const response = await api.get(`/products/${productId}/stock-locations`);
-      setStockLocations(response.data);
-      setShowStockModal(true);
-    } catch (error) {
-      handleApiError(error, "Failed to fetch stock locations");
-    }
+  const showStockLocations = (product) => {
+    setStockLocations({
+      product_name: product.name,
+      total_stock: product.current_stock,
+      stock_by_location: product.stock_by_location
+    });
+    setShowStockModal(true);
   };
 
   return (
@@ -162,7 +162,7 @@ const Products = () => {
               <td className="p-4">
                 <div className="flex gap-2">
                   <button
-                    onClick={() => fetchStockLocations(product.id)}
+                    onClick={() => showStockLocations(product)}
                     className="p-2 hover:bg-green-100 border-2 border-black font-bold"
                     title="View Stock Locations"
                   >